@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+
+Align cumulative death series on "days since N deaths".
+
+Where country_data.trim_to_first trims one series at a time, align_since
+works on a location x date matrix of cumulative deaths and aligns every
+location for every threshold in one pass. Rows need not share a calendar;
+series of different lengths can be stacked with stack_series, which pads
+them with NaN:
+
+    deaths = stack_series([obj.death for obj in state_objs + country_objs])
+    pops = [obj.population for obj in state_objs + country_objs]
+    aligned = align_since(deaths, [10, 100], pops)
+    aligned['per_capita'][0]   # location x day array since 10 deaths
+
+"""
+
+import numpy as np
+
+
+def stack_series(series):
+    """
+    Stacks 1-D series of different lengths into a float location x date
+    array, padding the end of shorter series with NaN.
+    """
+
+    n_days = max((len(val) for val in series), default = 0)
+    out = np.full((len(series), n_days), np.nan)
+    for ind, val in enumerate(series):
+        out[ind, :len(val)] = val
+
+    return out
+
+
+def first_index(deaths, thresholds):
+    """
+    Returns a threshold x location array with the index of the first day on
+    which each location reached each threshold, or -1 if it never did
+    (including when there are no days at all).
+    """
+
+    deaths = np.asarray(deaths, dtype = float)
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype = float))
+    if deaths.shape[-1] == 0:
+        return np.full((len(thresholds), ) + deaths.shape[:-1], -1)
+    reached = deaths[np.newaxis] >= thresholds[:, np.newaxis, np.newaxis]
+    return np.where(reached.any(axis = -1), reached.argmax(axis = -1), -1)
+
+
+def align_since(deaths, thresholds, population = None):
+    """
+    Aligns a location x date array of cumulative deaths on the first day
+    each location reached each threshold. Returns a dictionary of
+    threshold x location x day arrays, NaN-padded past the end of each series
+    and for locations that never reached a threshold:
+
+        "deaths"            cumulative deaths
+        "daily"             new deaths per day (the first day counts in full,
+                            as in country_data.plot_dtrim)
+        "per_capita"        cumulative deaths per population unit
+        "daily_per_capita"  new deaths per day per population unit
+
+    along with "start" (see first_index) and "thresholds". The per capita
+    arrays are only included if population (one value per location, e.g. in
+    millions) is given.
+    """
+
+    deaths = np.asarray(deaths, dtype = float)
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype = float))
+    start = first_index(deaths, thresholds)
+    n_days = deaths.shape[-1]
+
+    # Gather each location's series from its start day onwards
+    inds = start[..., np.newaxis] + np.arange(n_days)
+    valid = (start[..., np.newaxis] >= 0) & (inds < n_days)
+    gathered = np.take_along_axis(np.broadcast_to(deaths, start.shape + (n_days, )),
+                                  np.where(valid, inds, 0), axis = -1)
+    aligned = np.where(valid, gathered, np.nan)
+    daily = np.diff(aligned, axis = -1, prepend = 0.)
+
+    out = {'thresholds': thresholds, 'start': start,
+           'deaths': aligned, 'daily': daily}
+    if population is not None:
+        population = np.asarray(population, dtype = float)[:, np.newaxis]
+        out['per_capita'] = aligned/population
+        out['daily_per_capita'] = daily/population
+
+    return out
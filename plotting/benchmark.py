@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+
+Benchmarks for the read_data loaders and the state figure pipeline.
+
+Each case is timed over several repeats and then run once more under
+tracemalloc to record its peak allocated memory. Loaders are timed both
+parsing the text ("cold", cache disabled) and served from the column cache
+("warm"). Besides the real files in ../data, the IHME loader is run on
+synthetic files holding 10x and 100x the rows and locations of the
+2020_04_16.05 release (each location copied under new names), and the CSSE
+loader on a synthetic time series file when no real one is present.
+
+Every multiple runs the location-filtered loader for New York's last copy,
+which streams through the whole file. Loading all locations at once is only
+timed up to max_full_scale: at 100x it needs about 4 GB, mostly for the
+returned arrays and the location-grouped copies, and the 400 MB scratch
+file alone shows how the streaming path scales.
+
+Results are written as JSON so runs can be compared between versions:
+
+    python benchmark.py --output ../benchmarks/before.json
+    python benchmark.py --output ../benchmarks/after.json --compare ../benchmarks/before.json
+
+Everything runs offline; scratch files and the cache used for the warm runs
+go to a temporary directory that is removed afterwards.
+
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from datetime import date, datetime, timedelta
+
+import data_cache
+from read_data import get_data_ctrack, get_data_ihme, get_data_c19
+
+data_dir = os.path.join('..', 'data')
+ctrack_fname = os.path.join(data_dir, 'covid19_tracker', 'states-daily_20200424.csv')
+ihme_fname = os.path.join(data_dir, 'ihme', '2020_04_16.05', 'Hospitalization_all_locs.csv')
+c19_fname = os.path.join(data_dir, 'COVID-19', 'csse_covid_19_data',
+                         'csse_covid_19_time_series', 'time_series_covid19_deaths_global.csv')
+
+# Largest IHME multiple whose locations are all loaded at once
+max_full_scale = 10
+
+
+def measure(fun, repeat = 3):
+    """
+    Times repeat calls of fun() and then measures the peak memory allocated
+    during one more call. Returns a dictionary of results.
+    """
+
+    times = list()
+    for ind in range(repeat):
+        start = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fun()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': times, 'best': min(times),
+            'median': float(np.median(times)), 'peak_mb': peak/2**20}
+
+
+def print_result(name, result):
+    """
+    Prints one line summarizing a benchmark result.
+    """
+
+    print('%-26s %8.4f s %9.1f MB' % (name, result['best'], result['peak_mb']))
+
+
+def scale_ihme(fname, scale, out_name):
+    """
+    Writes a synthetic IHME file holding "scale" copies of every location of
+    fname, renamed "<location> #<copy>" after the first copy. Lines are
+    copied as they are with only the location field rewritten, so the
+    quoting and number formatting match the original file.
+    """
+
+    with open(fname, 'rt', newline = '') as fid:
+        header = fid.readline()
+        lines = fid.readlines()
+
+    headers = next(csv.reader([header]))
+    loc_ind = [ind for ind, column in enumerate(headers)
+               if column in ('location', 'location_name')]
+    with open(out_name, 'wt', newline = '') as fid:
+        fid.write(header)
+        fid.writelines(lines)
+        for copy in range(1, scale):
+            for line in lines:
+                fields = next(csv.reader([line]))
+                for ind in loc_ind:
+                    name = fields[ind]
+                    quoted = '"%s"' % name.replace('"', '""')
+                    new_name = '%s #%i' % (name, copy)
+                    if quoted in line:
+                        line = line.replace(quoted, '"%s"' % new_name.replace('"', '""'), 1)
+                    else:
+                        line = line.replace(name, new_name, 1)
+                fid.write(line)
+
+    return out_name
+
+
+def synthetic_c19(out_name, n_days = 100, seed = 0):
+    """
+    Writes a synthetic CSSE deaths time series with national rows, a
+    province-only country and quoted names, in the layout of
+    time_series_covid19_deaths_global.csv.
+    """
+
+    rng = np.random.default_rng(seed)
+    days = [date(2020, 1, 22) + timedelta(ind) for ind in range(n_days)]
+    headers = (['Province/State', 'Country/Region', 'Lat', 'Long'] +
+               ['%i/%i/%s' % (day.month, day.day, str(day.year)[2:]) for day in days])
+
+    rows = list()
+    for ind in range(180):
+        rows.append(['', 'Country %03i' % ind, '0.0', '0.0'])
+    rows.append(['', 'Korea, South', '0.0', '0.0'])
+    for province in ['Alberta', 'Ontario', 'Quebec', 'British Columbia']:
+        rows.append([province, 'Canada', '0.0', '0.0'])
+    for ind in range(80):
+        rows.append(['Province %02i' % ind, 'Country %03i' % (ind % 20), '0.0', '0.0'])
+    rows.sort(key = lambda row: (row[1], row[0]))
+
+    counts = np.cumsum(rng.poisson(5, (len(rows), n_days)), axis = 1)
+    with open(out_name, 'wt', newline = '') as fid:
+        writer = csv.writer(fid)
+        writer.writerow(headers)
+        for row, values in zip(rows, counts):
+            writer.writerow(row + values.tolist())
+
+    return out_name
+
+
+def loader_cases(scratch, scales):
+    """
+    Returns a list of (name, function, info) benchmark cases for the loaders.
+    """
+
+    cases = [('ctrack_all', lambda: get_data_ctrack(None, ctrack_fname),
+              {'file': ctrack_fname}),
+             ('ctrack_state', lambda: get_data_ctrack('NY', ctrack_fname),
+              {'file': ctrack_fname})]
+
+    for scale in scales:
+        fname = ihme_fname
+        if scale != 1:
+            fname = scale_ihme(ihme_fname, scale,
+                               os.path.join(scratch, 'ihme_x%i.csv' % scale))
+        info = {'file': fname, 'scale': scale, 'synthetic': scale != 1,
+                'bytes': os.path.getsize(fname)}
+        if scale <= max_full_scale:
+            cases.append(('ihme_all_x%i' % scale,
+                          lambda fname = fname: get_data_ihme(fname), info))
+
+        # The last copy of a location sits at the end of the file
+        location = 'New York' if scale == 1 else 'New York #%i' % (scale - 1)
+        cases.append(('ihme_location_x%i' % scale,
+                      lambda fname = fname, location = location:
+                          get_data_ihme(fname, location = location),
+                      info))
+
+    fname, country = c19_fname, 'Sweden'
+    if not os.path.isfile(fname):
+        fname = synthetic_c19(os.path.join(scratch, os.path.basename(c19_fname)))
+        country = 'Canada'
+    cases.append(('c19_country', lambda: get_data_c19(country, fname),
+                  {'file': fname, 'synthetic': fname != c19_fname}))
+
+    return cases
+
+
+def render_case(scratch):
+    """
+    Returns the benchmark case rendering both figures for one state from the
+    files (the full state pipeline).
+    """
+
+    from plot_state_batch import render_states
+
+    impath = os.path.join(scratch, 'images')
+    os.makedirs(impath, exist_ok = True)
+    fun = lambda: render_states(['NY'], data_filename = ctrack_fname,
+                                model_fname = ihme_fname, processes = 1,
+                                test_impath = impath, ihme_impath = impath)
+    return ('render_state', fun, {'file': [ctrack_fname, ihme_fname]})
+
+
+def run_benchmarks(scales = (1, 10, 100), repeat = 3, render = True):
+    """
+    Runs every benchmark case and returns the results as a dictionary.
+    """
+
+    scratch = tempfile.mkdtemp(prefix = 'c19_bench_')
+    saved = data_cache.cache_dir, data_cache.cache_enabled, data_cache.max_cache_bytes
+    data_cache.cache_dir = os.path.join(scratch, 'cache')
+    data_cache.max_cache_bytes = 2**40  # Keep the large synthetic entries
+
+    results = dict()
+    try:
+        cases = loader_cases(scratch, scales)
+        for name, fun, info in cases:
+            for mode, enabled in [('cold', False), ('warm', True)]:
+                data_cache.cache_enabled = enabled
+                if enabled:
+                    fun()  # Populate the cache
+                key = '%s_%s' % (name, mode)
+                results[key] = dict(info, **measure(fun, repeat))
+                print_result(key, results[key])
+
+        if render:
+            data_cache.cache_enabled = True
+            name, fun, info = render_case(scratch)
+            results[name] = dict(info, **measure(fun, repeat))
+            print_result(name, results[name])
+    finally:
+        data_cache.cache_dir, data_cache.cache_enabled, data_cache.max_cache_bytes = saved
+        shutil.rmtree(scratch, ignore_errors = True)
+
+    meta = {'timestamp': datetime.now().isoformat(timespec = 'seconds'),
+            'python': sys.version.split()[0], 'numpy': np.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+
+def compare(new, old):
+    """
+    Prints the ratio of new to old best times and peak memory for each case
+    present in both result sets.
+    """
+
+    print('%-26s %10s %10s' % ('case', 'time', 'memory'))
+    for name, result in new['results'].items():
+        if name in old['results']:
+            base = old['results'][name]
+            print('%-26s %9.2fx %9.2fx' % (name, result['best']/base['best'],
+                                           result['peak_mb']/max(base['peak_mb'], 1e-9)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the data loaders '
+                                     'and state figure rendering.')
+    parser.add_argument('--output', default = None,
+                        help = 'JSON file to write (default ../benchmarks/<timestamp>.json)')
+    parser.add_argument('--compare', default = None,
+                        help = 'earlier JSON results to compare against')
+    parser.add_argument('--scales', type = int, nargs = '+', default = [1, 10, 100],
+                        help = 'IHME size multiples to benchmark')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--no-render', action = 'store_true',
+                        help = 'skip the figure rendering case')
+    args = parser.parse_args()
+
+    out = run_benchmarks(args.scales, args.repeat, not args.no_render)
+
+    output = args.output
+    if output is None:
+        output = os.path.join('..', 'benchmarks', '%s.json' %
+                              datetime.now().strftime('%Y%m%d_%H%M%S'))
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(output, 'wt') as fid:
+        json.dump(out, fid, indent = 1)
+    print('Wrote %s' % output)
+
+    if args.compare is not None:
+        with open(args.compare, 'rt') as fid:
+            compare(out, json.load(fid))
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+
+Command line entry point for the plotting scripts.
+
+    python cli.py state NY CA --data ../data/covid19_tracker/states-daily_20200424.csv
+    python cli.py country US Sweden --data time_series_covid19_deaths_global.csv
+    python cli.py compare --states NY WA --countries Sweden Italy --state-data ... --country-data ...
+    python cli.py cache warm ../data/covid19_tracker/*.csv ../data/ihme/*.zip
+    python cli.py cache warm            # everything under ../data
+
+Options left out default to the settings at the top of plot_state_data.py
+(the tracker file to plot_state_batch.py), plot_country_data.py and
+sweden_comparisons.py (which uses the newest tracker snapshot on disk).
+Unknown state codes and comparison countries are reported as usage errors.
+Data and plotting modules are only imported by the subcommand that needs
+them, so --help and cache runs do not load matplotlib.
+
+"""
+
+import os
+import sys
+import argparse
+
+
+# Render manifest kept in the output directory (see render_manifest.py)
+manifest_name = 'render_manifest.json'
+
+
+def add_window_args(parser):
+    """
+    Adds the options shared by the IHME comparison subcommands.
+    """
+
+    parser.add_argument('--data', help = 'reported data file')
+    parser.add_argument('--model', help = 'IHME Hospitalization_all_locs.csv file')
+    parser.add_argument('--start', help = 'first date to plot (yyyymmdd)')
+    parser.add_argument('--stop', help = 'last IHME date to plot (yyyymmdd)')
+    parser.add_argument('--data-date', help = 'data date shown in titles, e.g. "04 May"')
+    parser.add_argument('--project-date', help = 'IHME release date shown in titles')
+    parser.add_argument('--outdir', default = os.path.join('..', 'images'),
+                        help = 'image directory (default ../images)')
+    parser.add_argument('--force', action = 'store_true',
+                        help = 're-render figures whose inputs have not changed')
+
+
+def pick(value, default):
+    """
+    Returns value unless it is None.
+    """
+
+    return default if value is None else value
+
+
+def style_map(names, defaults):
+    """
+    Returns {name: plot style} cycling through colors, then line styles;
+    defaults is returned when no names are given.
+    """
+
+    if not names:
+        return defaults
+    styles = ['-', '--', '-.', ':']
+    return {name: {'color': 'rbk'[ind % 3], 'linestyle': styles[ind // 3 % 4]}
+            for ind, name in enumerate(names)}
+
+
+def check_locations(parser, names, column, kind, what):
+    """
+    Reports names without a "column" entry for a location of "kind" in the
+    locations table through parser.error.
+    """
+
+    from locations import locations
+
+    known = locations.column_map(column, 'kind', kind = kind)
+    unknown = [name for name in names or () if name not in known]
+    if unknown:
+        parser.error('unknown %s: %s (known: %s)' % (what, ', '.join(unknown),
+                                                      ', '.join(sorted(known))))
+
+
+def run_state(args):
+    """
+    Renders the testing and IHME comparison figures for US states.
+    """
+
+    import plot_state_data as cfg
+    import plot_state_batch as batch
+
+    test_impath = os.path.join(args.outdir, 'test_data')
+    ihme_impath = os.path.join(args.outdir, 'ihme_compare')
+    for path in (test_impath, ihme_impath):
+        os.makedirs(path, exist_ok = True)
+
+    imnames = batch.render_states(states = args.states or None,
+                                  data_filename = pick(args.data, batch.data_filename),
+                                  model_fname = pick(args.model, cfg.model_fname),
+                                  data_date = pick(args.data_date, batch.data_date),
+                                  project_date = pick(args.project_date, cfg.project_date),
+                                  start_date = pick(args.start, cfg.start_date),
+                                  stop_date = pick(args.stop, cfg.stop_date),
+                                  ylpct = pick(args.ylpct, cfg.ylpct),
+                                  plot_testing = not args.no_testing,
+                                  plot_hosp_death = not args.no_hosp_death,
+                                  test_impath = test_impath, ihme_impath = ihme_impath,
+                                  processes = args.processes,
+                                  manifest = os.path.join(args.outdir, manifest_name),
+                                  force = args.force)
+    for imname in imnames:
+        print(imname)
+
+
+def run_country(args):
+    """
+    Renders the IHME death comparison figure for each country.
+    """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import plot_country_data as cfg
+
+    from render_manifest import render_manifest, fingerprint
+
+    impath = os.path.join(args.outdir, 'ihme_compare')
+    os.makedirs(impath, exist_ok = True)
+    manifest = render_manifest(os.path.join(args.outdir, manifest_name))
+    data_date = pick(args.data_date, cfg.data_date)
+    project_date = pick(args.project_date, cfg.project_date)
+    for country in args.countries:
+        try:
+            series, proj = cfg.country_series(country, pick(args.data, cfg.data_filename),
+                                              pick(args.model, cfg.model_fname),
+                                              pick(args.start, cfg.start_date),
+                                              pick(args.stop, cfg.stop_date))
+        except KeyError as err:
+            print('Skipping %s: %s' % (country, err.args[0]))
+            continue
+        key = 'country|%s|%s' % (impath, country)
+        fp = fingerprint('country', country, series, proj, data_date, project_date)
+        if not args.force and manifest.is_current(key, fp):
+            continue
+        fig, imname = cfg.plot_country_figure(country, series, proj, data_date,
+                                              project_date, impath = impath)
+        plt.close(fig)
+        manifest.record(key, fp, imname)
+        print(imname)
+
+    manifest.save()
+
+
+def run_compare(args):
+    """
+    Renders the population-adjusted deaths comparison of states and countries.
+    """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import sweden_comparisons as cfg
+
+    os.makedirs(args.outdir, exist_ok = True)
+    fig, figname = cfg.plot_comparison(style_map(args.states, cfg.highlight_states),
+                                       style_map(args.countries, cfg.highlight_countries),
+                                       pick(args.state_data, cfg.state_filename),
+                                       pick(args.country_data, cfg.country_filename),
+                                       pick(args.state_data_date, cfg.state_data_date),
+                                       pick(args.country_data_date, cfg.country_data_date),
+                                       n_death = args.n_death, impath = args.outdir)
+    print(figname)
+
+
+def run_cache(args):
+    """
+    Parses files into the column cache (all of ../data by default, several
+    files at once), lists it or clears it.
+    """
+
+    import data_cache
+
+    if args.action == 'clear':
+        if not args.files:
+            print('Removed %i entries' % data_cache.invalidate())
+        for fname in args.files:
+            print('%s: removed %i entries' % (fname, data_cache.invalidate(fname)))
+        return
+
+    if args.action == 'list':
+        if os.path.isdir(data_cache.cache_dir):
+            for name in sorted(os.listdir(data_cache.cache_dir)):
+                path = os.path.join(data_cache.cache_dir, name)
+                print('%10.1f MB  %s' % (os.path.getsize(path)/2**20, name))
+        return
+
+    from prefetch import prefetch, data_sources
+
+    files = args.files or data_sources()
+    for fname, data, error in prefetch(files, workers = args.workers, load = False):
+        if error is None:
+            print('Cached %s' % fname)
+        else:
+            print('Failed %s: %s' % (fname, error))
+
+
+def build_parser():
+    """
+    Returns the argument parser with all subcommands.
+    """
+
+    parser = argparse.ArgumentParser(description = 'Covid-19 data plots.')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'print per-stage timings at the end (see instrument.py)')
+    parser.add_argument('--profile-report', metavar = 'FILE',
+                        help = 'also write the timings to a JSON file')
+    sub = parser.add_subparsers(dest = 'command', required = True)
+
+    state = sub.add_parser('state', help = 'US state testing and IHME comparison figures')
+    state.add_argument('states', nargs = '*', help = 'postal codes (default: all states)')
+    add_window_args(state)
+    state.add_argument('--ylpct', type = float, nargs = 2,
+                       help = 'limits of the percentage positive axis')
+    state.add_argument('--no-testing', action = 'store_true')
+    state.add_argument('--no-hosp-death', action = 'store_true')
+    state.add_argument('--processes', type = int,
+                       help = 'worker processes (default: one per core)')
+    state.set_defaults(run = run_state)
+
+    country = sub.add_parser('country', help = 'country IHME death comparison figures')
+    country.add_argument('countries', nargs = '+', help = 'CSSE country names')
+    add_window_args(country)
+    country.set_defaults(run = run_country)
+
+    compare = sub.add_parser('compare', help = 'deaths per million since N deaths')
+    compare.add_argument('--states', nargs = '*', help = 'postal codes')
+    compare.add_argument('--countries', nargs = '*', help = 'CSSE country names')
+    compare.add_argument('--state-data', help = 'Covid Tracking file')
+    compare.add_argument('--country-data', help = 'CSSE time series file')
+    compare.add_argument('--state-data-date')
+    compare.add_argument('--country-data-date')
+    compare.add_argument('--n-death', type = int, default = 10)
+    compare.add_argument('--outdir', default = os.path.join('..', 'images'))
+    compare.set_defaults(run = run_compare)
+
+    cache = sub.add_parser('cache', help = 'manage the parsed column cache')
+    cache.add_argument('action', choices = ['warm', 'list', 'clear'])
+    cache.add_argument('files', nargs = '*')
+    cache.add_argument('--workers', type = int,
+                       help = 'parallel parsers for warm (default: one per core)')
+    cache.set_defaults(run = run_cache)
+
+    return parser
+
+
+def main(argv = None):
+    """
+    Parses the command line and runs the chosen subcommand.
+    """
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command in ('state', 'compare'):
+        check_locations(parser, args.states, 'postal', 'state', 'state')
+    if args.command == 'compare':
+        check_locations(parser, args.countries, 'csse', 'country', 'country')
+
+    if args.profile or args.profile_report:
+        import instrument
+        instrument.enable()
+
+    args.run(args)
+
+    if args.profile or args.profile_report:
+        if args.profile:
+            instrument.print_report()
+        if args.profile_report:
+            instrument.write_report(args.profile_report)
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+
+Deduplicated store of Covid Tracking daily snapshots.
+
+Each "states-daily_YYYYMMDD.csv" download repeats nearly every row of the
+previous one. The store keeps one chunk file per ingested snapshot holding
+only the rows, keyed by (date, state), that are new or changed relative to
+the snapshot before it, plus tombstones for rows that disappeared, and the
+snapshot's row order as positions into its sorted keys. A small index of the
+latest row fingerprints makes each ingest proportional to the new file
+rather than to the whole history.
+
+Any ingested snapshot can be rebuilt on demand by replaying the chunks up to
+it, and get_data reproduces get_data_ctrack for that snapshot:
+
+    store = ctrack_store('../cache/ctrack_store')
+    store.ingest_dir('../data/covid19_tracker')
+    data = store.get_data('NY')                           # latest snapshot
+    data = store.get_data('NY', 'states-daily_20200410.csv')
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from read_data import read_columns, group_rows, type_ctrack_columns, select_ctrack
+
+store_meta = 'store.json'
+store_latest = 'latest.npz'
+
+
+def row_fingerprints(raw):
+    """
+    Returns a sha1 fingerprint per row of a dictionary of string columns.
+    Only non-empty fields contribute, by name, so a row's fingerprint does
+    not change when later snapshots add (empty) columns.
+    """
+
+    names = sorted(key for key in raw.keys())
+    n_rows = len(raw[names[0]]) if names else 0
+    prints = list()
+    for ind in range(n_rows):
+        fields = ['%s=%s' % (name, raw[name][ind]) for name in names
+                  if raw[name][ind] != '']
+        prints.append(hashlib.sha1('\x1f'.join(fields).encode('utf-8')).hexdigest())
+
+    return np.array(prints, dtype = 'S40')
+
+
+def row_keys(raw):
+    """
+    Returns the (date, state) key of each row as a single string array.
+    """
+
+    return np.char.add(np.char.add(raw['date'], '|'), raw['state'])
+
+
+class ctrack_store:
+    """
+    Append-only, deduplicated history of Covid Tracking snapshots stored in
+    a directory.
+    """
+
+    def __init__(self, path):
+        """
+        Open (or create) a snapshot store in directory "path".
+        """
+
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        try:
+            with open(os.path.join(path, store_meta), 'rt') as fid:
+                meta = json.load(fid)
+        except OSError:
+            meta = {'snapshots': list(), 'columns': list()}
+
+        self.snapshots = meta['snapshots']
+        self.columns = meta['columns']
+
+    def snapshot_names(self):
+        """
+        Returns the names of the ingested snapshots in ingest order.
+        """
+
+        return [snap['name'] for snap in self.snapshots]
+
+    def snapshot_index(self, snapshot):
+        """
+        Returns the position of a snapshot given its name or index; None
+        selects the latest snapshot.
+        """
+
+        if snapshot is None:
+            return len(self.snapshots) - 1
+        if isinstance(snapshot, str):
+            return self.snapshot_names().index(snapshot)
+
+        return range(len(self.snapshots))[snapshot]
+
+    def chunk_name(self, ind):
+        """
+        Returns the file name of the chunk written by snapshot "ind".
+        """
+
+        return os.path.join(self.path, 'chunk_%05i.npz' % ind)
+
+    def save_meta(self):
+        """
+        Writes the snapshot list and column names to the store directory.
+        """
+
+        tmp_name = os.path.join(self.path, store_meta + '.tmp')
+        with open(tmp_name, 'wt') as fid:
+            json.dump({'snapshots': self.snapshots, 'columns': self.columns},
+                      fid, indent = 1)
+        os.replace(tmp_name, os.path.join(self.path, store_meta))
+
+    def save_array(self, name, compressed = False, **arrays):
+        """
+        Writes arrays to an .npz file in the store through a temporary file.
+        """
+
+        tmp_name = os.path.join(self.path, name + '.tmp')
+        with open(tmp_name, 'wb') as fid:
+            (np.savez_compressed if compressed else np.savez)(fid, **arrays)
+        os.replace(tmp_name, os.path.join(self.path, name))
+
+    def load_latest(self):
+        """
+        Returns the live row keys and fingerprints after the last ingest.
+        If the index is missing or was not written by the last recorded
+        ingest (e.g. after a crash), it is rebuilt from the chunks.
+        """
+
+        if len(self.snapshots) == 0:
+            return np.array([], dtype = str), np.array([], dtype = 'S40')
+
+        try:
+            with np.load(os.path.join(self.path, store_latest)) as latest:
+                if int(latest['n_snapshots']) == len(self.snapshots):
+                    return latest['keys'], latest['prints']
+        except (OSError, KeyError, ValueError):
+            pass
+
+        raw = self.raw_columns()
+        keys, prints = row_keys(raw), row_fingerprints(raw)
+        self.save_array(store_latest, keys = keys, prints = prints,
+                        n_snapshots = len(self.snapshots))
+        return keys, prints
+
+    def ingest(self, fname, name = None):
+        """
+        Adds a snapshot file to the store, writing only new or changed rows.
+        Files already ingested under the same name are skipped. Returns the
+        number of rows written.
+        """
+
+        if name is None:
+            name = os.path.basename(fname)
+        if name in self.snapshot_names():
+            return 0
+
+        with open(fname, 'rt') as fid:
+            headers, columns = read_columns(fid)
+        raw = dict(zip(headers, columns))
+        keys = row_keys(raw)
+        prints = row_fingerprints(raw)
+
+        # Compare against the latest version of every live key
+        old_keys, old_prints = self.load_latest()
+        old_lookup = dict(zip(old_keys.tolist(), old_prints.tolist()))
+        changed = np.array([old_lookup.get(key) != fp for key, fp in
+                            zip(keys.tolist(), prints.tolist())], dtype = bool)
+        removed = np.setdiff1d(old_keys, keys)
+
+        for header in headers:
+            if header not in self.columns:
+                self.columns.append(header)
+
+        chunk = {'keys': np.concatenate((keys[changed], removed)),
+                 'deleted': np.concatenate((np.zeros(changed.sum(), dtype = bool),
+                                            np.ones(len(removed), dtype = bool))),
+                 'order': np.searchsorted(np.sort(keys), keys).astype(np.int32)}
+        for header in headers:
+            chunk['col_' + header] = np.concatenate(
+                (raw[header][changed], np.full(len(removed), '', dtype = raw[header].dtype)))
+
+        # Chunk, then snapshot list, then index: a crash before save_meta
+        # leaves an unreferenced chunk that the next ingest overwrites, and
+        # one after it leaves an index that load_latest rebuilds
+        ind = len(self.snapshots)
+        self.save_array(os.path.basename(self.chunk_name(ind)), compressed = True, **chunk)
+
+        stat = os.stat(fname)
+        self.snapshots.append({'name': name, 'columns': headers,
+                               'rows': len(keys), 'size': stat.st_size,
+                               'mtime_ns': stat.st_mtime_ns})
+        self.save_meta()
+        self.save_array(store_latest, keys = keys, prints = prints,
+                        n_snapshots = len(self.snapshots))
+
+        return int(len(chunk['keys']))
+
+    def ingest_dir(self, path, pattern = 'states-daily_'):
+        """
+        Ingests every snapshot file in a directory, in name order, that has
+        not already been ingested. Returns the names of the new snapshots.
+        """
+
+        names = sorted(name for name in os.listdir(path)
+                       if name.startswith(pattern) and name.endswith('.csv'))
+        new_names = list()
+        for name in names:
+            if name not in self.snapshot_names():
+                self.ingest(os.path.join(path, name), name)
+                new_names.append(name)
+
+        return new_names
+
+    def raw_columns(self, snapshot = None, provenance = False):
+        """
+        Rebuilds the string columns of a snapshot, in the row order of the
+        original file. With provenance = True a "snapshot" column is added
+        holding the index of the snapshot each row was last written by.
+        
+        Stores written before row orders were recorded give the rows newest
+        date first and then by state instead.
+        """
+
+        stop = self.snapshot_index(snapshot)
+        headers = self.snapshots[stop]['columns']
+
+        all_keys, all_deleted, all_source = list(), list(), list()
+        all_cols = {header: list() for header in headers}
+        file_order = None
+        for ind in range(stop + 1):
+            with np.load(self.chunk_name(ind)) as chunk:
+                if ind == stop and 'order' in chunk:
+                    file_order = chunk['order']
+                n_rows = len(chunk['keys'])
+                all_keys.append(chunk['keys'])
+                all_deleted.append(chunk['deleted'])
+                all_source.append(np.full(n_rows, ind))
+                for header in headers:
+                    name = 'col_' + header
+                    if name in chunk:
+                        all_cols[header].append(chunk[name])
+                    else:
+                        all_cols[header].append(np.full(n_rows, '', dtype = str))
+
+        keys = np.concatenate(all_keys)
+        deleted = np.concatenate(all_deleted)
+        source = np.concatenate(all_source)
+
+        # The last version of each key wins; drop keys whose last version
+        # is a tombstone
+        order, unique_keys, offsets = group_rows(keys)
+        last = order[offsets[1:] - 1]
+        last = last[~deleted[last]]
+
+        raw = {header: np.concatenate(all_cols[header])[last] for header in headers}
+        source = source[last]
+
+        # Rows are now sorted by key, which the recorded order indexes
+        if file_order is None:
+            file_order = np.lexsort((raw['state'], -raw['date'].astype(int)))
+        out = dict()
+        for header, val in raw.items():
+            width = np.char.str_len(val).max(initial = 1)
+            out[header] = val[file_order].astype('U%i' % width)
+        if provenance:
+            out['snapshot'] = source[file_order]
+
+        return out
+
+    def columns_for(self, snapshot = None):
+        """
+        Returns the typed columns of a snapshot, as load_ctrack_columns would
+        for the original file.
+        """
+
+        return type_ctrack_columns(self.raw_columns(snapshot))
+
+    def get_data(self, state, snapshot = None, columns = None, compact = False):
+        """
+        get_data_ctrack equivalent for a stored snapshot (latest by default).
+        """
+
+        return select_ctrack(state, self.columns_for(snapshot), columns, compact)
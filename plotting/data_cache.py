@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+
+Persistent binary cache for parsed CSV columns.
+
+After a source file is parsed once, its columns are written to a single
+binary file in the cache directory. Later loads memory-map that file
+instead of parsing the text again. Entries are keyed by the source path,
+its size and modification time, and the version of the parser that built
+them, so editing a data file or changing a parser invalidates the entry.
+
+Cache file layout:
+
+    8 byte magic, 8 byte header length, JSON header, then one block per
+    column aligned to 64 bytes. The header lists the name, dtype, shape and
+    offset of each column.
+
+The cache directory defaults to "../cache" next to the plotting directory
+and may be set with the C19_CACHE_DIR environment variable. Set
+C19_NO_CACHE=1 to bypass the cache entirely. Loaded columns are read-only
+whether they come from the cache or were just parsed, so code that works
+on a cache hit also works on a miss; copy a column before modifying it.
+
+"""
+
+import os
+import json
+import mmap
+import hashlib
+import tempfile
+import numpy as np
+
+from instrument import timed
+
+cache_dir = os.environ.get('C19_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        '..', 'cache'))
+cache_enabled = os.environ.get('C19_NO_CACHE', '') in ('', '0')
+max_cache_bytes = 512*2**20
+
+cache_magic = b'C19CACHE'
+cache_ext = '.c19c'
+cache_align = 64
+
+
+def source_prefix(fname, member = None):
+    """
+    Returns the part of a cache file name identifying the source: a hash of
+    the path, then a hash of the archive member ("" for plain files). Every
+    entry of an archive, whatever the member, starts with the path part.
+    """
+
+    path = os.path.normcase(os.path.abspath(fname))
+    path_hash = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    if member is None:
+        return path_hash + '_'
+
+    member_hash = hashlib.sha1(member.encode('utf-8')).hexdigest()[:8]
+    return '%s_%s_' % (path_hash, member_hash)
+
+
+def source_key(fname, version, member = None):
+    """
+    Returns the cache file name for the current state of a source file as
+    read by the given parser version.
+    """
+
+    stat = os.stat(fname)
+    stamp = '%i:%i:%s' % (stat.st_size, stat.st_mtime_ns, version)
+    suffix = hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:16]
+    return '%s%s%s' % (source_prefix(fname, member), suffix, cache_ext)
+
+
+@timed('cache.write')
+def write_entry(path, columns, source = ''):
+    """
+    Writes a dictionary of arrays to a cache file. The file is written to a
+    uniquely named temporary file first, so readers never see a partial
+    entry and concurrent writers (threads or processes) never share one.
+    """
+
+    columns = {key: np.ascontiguousarray(val) for key, val in columns.items()}
+    header = {'source': source, 'columns': list()}
+
+    # Offsets are relative to the first data block until the header is sized
+    offset = 0
+    for key, val in columns.items():
+        if val.dtype.hasobject:
+            raise TypeError('Cannot cache object column "%s"' % key)
+        header['columns'].append({'name': key, 'dtype': val.dtype.str,
+                                  'shape': list(val.shape), 'offset': offset})
+        offset += -(-val.nbytes // cache_align)*cache_align
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = len(cache_magic) + 8 + len(header_bytes)
+    data_start = -(-data_start // cache_align)*cache_align
+
+    handle, tmp_path = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(path),
+                                        prefix = os.path.basename(path) + '.')
+    try:
+        with os.fdopen(handle, 'wb') as fid:
+            fid.write(cache_magic)
+            fid.write(np.uint64(len(header_bytes)).tobytes())
+            fid.write(header_bytes)
+            for col, val in zip(header['columns'], columns.values()):
+                fid.seek(data_start + col['offset'])
+                fid.write(val.tobytes())
+            fid.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+@timed('cache.read')
+def read_entry(path):
+    """
+    Memory-maps a cache file and returns a dictionary of read-only arrays
+    backed by the mapping.
+    """
+
+    with open(path, 'rb') as fid:
+        buf = mmap.mmap(fid.fileno(), 0, access = mmap.ACCESS_READ)
+
+    if buf[:len(cache_magic)] != cache_magic:
+        raise ValueError('%s is not a cache file' % path)
+
+    header_len = int(np.frombuffer(buf, dtype = np.uint64, count = 1,
+                                   offset = len(cache_magic))[0])
+    header_start = len(cache_magic) + 8
+    header = json.loads(buf[header_start:header_start + header_len].decode('utf-8'))
+    data_start = -(-(header_start + header_len) // cache_align)*cache_align
+
+    out = dict()
+    for col in header['columns']:
+        dtype = np.dtype(col['dtype'])
+        count = int(np.prod(col['shape']))
+        out[col['name']] = np.frombuffer(buf, dtype = dtype, count = count,
+                                         offset = data_start + col['offset']
+                                         ).reshape(col['shape'])
+
+    return out
+
+
+def cached_entry(fname, version, member = None):
+    """
+    Returns the cached columns for a source file if a current entry exists,
+    or None otherwise. Nothing is parsed or written.
+    """
+
+    if not cache_enabled:
+        return None
+
+    path = os.path.join(cache_dir, source_key(fname, version, member))
+    try:
+        out = read_entry(path)
+        os.utime(path)  # Mark as recently used for eviction
+        return out
+    except (OSError, ValueError):
+        return None
+
+
+def read_only(columns):
+    """
+    Marks every array of a dictionary of columns read-only, as the
+    memory-mapped arrays of a cache entry are. Returns the dictionary.
+    """
+
+    for val in columns.values():
+        val.flags.writeable = False
+    return columns
+
+
+def cached_columns(fname, reader, version, member = None):
+    """
+    Returns reader(fname), or reader(fname, member) for an archive member,
+    loading it from the cache when a current entry exists and storing the
+    result otherwise. reader must return a dictionary of (non-object) arrays.
+    The arrays are read-only in every case.
+    """
+
+    args = (fname, ) if member is None else (fname, member)
+    if not cache_enabled:
+        return read_only(reader(*args))
+
+    out = cached_entry(fname, version, member)
+    if out is not None:
+        return out
+
+    path = os.path.join(cache_dir, source_key(fname, version, member))
+    out = read_only(reader(*args))
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        invalidate(fname, member, exact = True)
+        source = os.path.abspath(fname)
+        if member is not None:
+            source = '%s::%s' % (source, member)
+        write_entry(path, out, source = source)
+        evict()
+    except (OSError, TypeError):
+        pass
+
+    return out
+
+
+def invalidate(fname = None, member = None, exact = False):
+    """
+    Removes the cache entries for a source file, including those of every
+    member if it is an archive, or only those of one member if given. With
+    exact = True the entries read from an archive without naming a member
+    are kept apart from its members' entries. Every entry is removed if
+    fname is None. Returns the number of entries removed.
+    """
+
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    prefix = '' if fname is None else source_prefix(fname, member)
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if not (name.startswith(prefix) and name.endswith(cache_ext)):
+            continue
+        if exact and '_' in name[len(prefix):-len(cache_ext)]:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+        except OSError:
+            pass
+
+    return removed
+
+
+def evict(max_bytes = None):
+    """
+    Removes least recently used cache entries until the cache directory
+    holds at most max_bytes (max_cache_bytes by default).
+    """
+
+    if max_bytes is None:
+        max_bytes = max_cache_bytes
+
+    entries = list()
+    for name in os.listdir(cache_dir):
+        if name.endswith(cache_ext):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
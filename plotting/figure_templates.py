@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+
+Reusable versions of the state figures in plot_state_data.py.
+
+Each template builds its figure, axes, lines, labels and legends once. A new
+state is drawn by swapping the line data in with set_data, updating the axis
+limits, ticks and title, and saving. Rendering hundreds of states therefore
+reuses one figure per layout instead of creating (and leaking) a new figure
+each time.
+
+    template = hosp_death_template()
+    for state_long, series, proj in jobs:
+        template.update(state_long, series, proj, data_date, project_date)
+        template.save(os.path.join(impath, imname))
+
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from read_data import to_days
+from rolling import rolling_mean, rolling_ratio
+from plot_state_data import date_ticks
+from instrument import timed, stage
+
+lightblue = [0.3, 0.3, 0.8]
+darkblue = [0.2, 0.2, 0.6]
+red = [0.6, 0.2, 0.2]
+lightred = [0.8, 0.4, 0.4]
+gray = 0.3*np.array([1, 1, 1])
+
+
+def day_positions(dates, origin):
+    """
+    Returns the x position of each "yyyymmdd" date as days since origin.
+    """
+
+    return (to_days(dates) - to_days([origin])[0]).astype(float)
+
+
+def rescale_y(ax):
+    """
+    Recomputes an axis' data limits from its current lines and autoscales y.
+    """
+
+    ax.relim()
+    ax.set_autoscaley_on(True)  # Setting ylim for the last state turned it off
+    ax.autoscale_view(scalex = False)
+
+
+class testing_template:
+    """
+    1 x 3 panel of all tests, positive tests and percentage positive.
+    """
+
+    def __init__(self, ylpct = None):
+        """
+        Build the figure; ylpct optionally fixes the percentage axis limits.
+        """
+
+        self.ylpct = ylpct
+        self.fig, ax = plt.subplots(1, 3, figsize = (17, 5))
+        self.ax = ax
+
+        self.total, = ax[0].plot([], [], 'o', label = 'Total Tests',
+                                 color = darkblue, markerfacecolor = lightblue)
+        self.total_avg, = ax[0].plot([], [], 'k--', label = '7 Day Moving Average')
+        ax[0].set_ylabel('Number of Tests', fontsize = 12, fontweight = 'bold')
+        ax[0].set_xlabel('Date', fontsize = 12, fontweight = 'bold')
+
+        self.pos, = ax[1].plot([], [], 'o', label = 'Positive Tests',
+                               color = red, markerfacecolor = lightred)
+        self.pos_avg, = ax[1].plot([], [], 'k--', label = '7 Day Moving Average')
+        ax[1].set_ylabel('Number of Positives', fontsize = 12, fontweight = 'bold')
+        ax[1].set_xlabel('Date', fontsize = 12, fontweight = 'bold')
+
+        self.pct_avg, = ax[2].plot([], [], 'k--', label = '7 Day Moving Average')
+        self.pct, = ax[2].plot([], [], 'o', color = 'k', markerfacecolor = gray)
+        ax[2].set_xlabel('Date', fontweight = 'bold', fontsize = 12)
+        ax[2].set_ylabel('Percentage of Positive Tests',
+                         fontweight = 'bold', fontsize = 12)
+
+        ax[0].set_title('All Tests', fontsize = 12, fontweight = 'bold')
+        ax[1].set_title('Positive Tests', fontsize = 12, fontweight = 'bold')
+        ax[2].set_title('Percentage of Tests Positive', fontsize = 12, fontweight = 'bold')
+        ax[1].legend()
+
+        self.title = self.fig.suptitle('', fontsize = 14, fontweight = 'bold')
+
+    @timed('render.testing_update')
+    def update(self, state_long, series, proj):
+        """
+        Swap in the data for one state (see plot_testing_figure).
+        """
+
+        dates, dpos, dneg = series['dates'], series['dpos'], series['dneg']
+        x = day_positions(dates, proj['dates'][0])
+        xticks, xticklabels = date_ticks(proj['dates'])
+
+        dtotal = dpos + dneg
+        pct = 100*rolling_ratio(dpos, dtotal, 1)
+        pct_avg = 100*rolling_ratio(dpos, dtotal, 7)
+
+        self.total.set_data(x, dtotal)
+        self.total_avg.set_data(x, rolling_mean(dtotal, 7))
+        self.pos.set_data(x, dpos)
+        self.pos_avg.set_data(x, rolling_mean(dpos, 7))
+        self.pct_avg.set_data(x, pct_avg)
+        self.pct.set_data(x, pct)
+
+        for ind, ax in enumerate(self.ax):
+            ax.set_xticks(xticks)
+            ax.set_xticklabels(xticklabels)
+            rescale_y(ax)
+            if ind < 2 or self.ylpct is None:
+                ax.set_ylim([-5, ax.get_ylim()[1]])
+            else:
+                ax.set_ylim(self.ylpct)
+            ax.set_xlim([0, len(dates)])
+
+        self.title.set_text('%s: All Tests, Positive Tests, and Positive Test Percentages' %
+                            state_long)
+
+    def save(self, fname):
+        """
+        Save the current state of the figure.
+        """
+
+        with stage('render.savefig'):
+            self.fig.savefig(fname, bbox_inches = 'tight')
+
+
+class hosp_death_template:
+    """
+    2 x 2 panel of reported hospitalizations and deaths vs IHME projections.
+    """
+
+    def __init__(self):
+        """
+        Build the figure with empty lines.
+        """
+
+        self.fig, ax = plt.subplots(2, 2, figsize = (12, 6))
+        ax = ax.flatten()
+        self.ax = ax
+        self.lines = dict()
+
+        panels = [(0, 'hosp', 'Total Hospitalized', 'Hospitalizations'),
+                  (2, 'dhosp', 'New Hospitalized', None),
+                  (1, 'death', 'Total Deaths', 'Deaths'),
+                  (3, 'ddeath', 'New Deaths', None)]
+        for ind, key, ylabel, title in panels:
+            legend = title is not None
+            reported, = ax[ind].plot([], [], 'o', color = darkblue,
+                                     markerfacecolor = lightblue,
+                                     label = 'Reported' if legend else None)
+            mean, = ax[ind].plot([], [], 'k-',
+                                 label = 'IHME Projected [Mean]' if legend else None)
+            lower, = ax[ind].plot([], [], 'r--',
+                                  label = 'IHME Projected [Lower CI]' if legend else None)
+            upper, = ax[ind].plot([], [], 'r--',
+                                  label = 'IHME Projected [Upper CI]' if legend else None)
+            self.lines[key] = (ind, reported, (mean, lower, upper))
+
+            if legend:
+                ax[ind].legend()
+                ax[ind].set_title(title, fontsize = 12, fontweight = 'bold')
+            else:
+                ax[ind].set_xlabel('Date', fontsize = 12, fontweight = 'bold')
+            ax[ind].set_ylabel(ylabel, fontsize = 12, fontweight = 'bold')
+
+        self.title = self.fig.suptitle('', fontsize = 14, fontweight = 'bold')
+
+    @timed('render.hosp_death_update')
+    def update(self, state_long, series, proj, data_date, project_date):
+        """
+        Swap in the data for one state (see plot_hosp_death_figure).
+        """
+
+        dates_ihme = proj['dates']
+        x = day_positions(series['dates'], dates_ihme[0])
+        x_ihme = np.arange(len(dates_ihme), dtype = float)
+        xticks, xticklabels = date_ticks(dates_ihme)
+
+        for key, (ind, reported, projected) in self.lines.items():
+            reported.set_data(x, series[key])
+            for line, values in zip(projected, proj[key]):
+                line.set_data(x_ihme, values)
+
+            ax = self.ax[ind]
+            rescale_y(ax)
+            ax.set_xlim(0, len(dates_ihme) - 1)
+            ax.set_xticks(xticks)
+            ax.set_xticklabels(xticklabels)
+
+        self.title.set_text('%s: Reported Data [%s] vs IHME Projections [%s]' %
+                            (state_long, data_date, project_date))
+
+    def save(self, fname):
+        """
+        Save the current state of the figure.
+        """
+
+        with stage('render.savefig'):
+            self.fig.savefig(fname, bbox_inches = 'tight')
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+
+Accuracy of the IHME projections against reported data.
+
+Every release in the IHME vintage cube (see ihme_cube.py) is scored against
+the reported values for the same locations and dates: Covid Tracking data
+for US states and the CSSE time series for countries. Scored metrics are
+
+    totdea   cumulative deaths        (tracker "death", CSSE deaths)
+    deaths   daily deaths             (daily change of the above)
+    allbed   hospital beds in use     (tracker "hospitalizedCurrently")
+    admis    daily admissions         (daily change of tracker
+                                       "hospitalizedCumulative")
+
+For each release x location x metric the engine computes the number of
+scored days, the mean absolute error and bias of the mean projection, the
+fraction of reported values inside the [lower, upper] interval, and the mean
+absolute error by forecast horizon (days after the release date). Only days
+after the release date are scored by default. All of it is computed with
+array operations over the aligned release x location x date arrays.
+
+    cube = get_ihme_cube('../cache/ihme_cube.npy')
+    table, scores = score_cube(cube, ctrack_fname = tracker_file)
+    table[table['metric'] == 'totdea']
+
+"""
+
+import numpy as np
+
+from read_data import get_matrix_ctrack, c19_version, load_c19_columns, to_days
+from data_cache import cached_columns
+from state_metrics import daily_change
+from locations import locations
+
+score_metrics = ('totdea', 'deaths', 'allbed', 'admis')
+
+
+def release_days(releases):
+    """
+    Returns the release date of each IHME release name ("2020_04_16.05")
+    as datetime64[D].
+    """
+
+    return np.array([name[:10].replace('_', '-') for name in releases],
+                    dtype = 'datetime64[D]')
+
+
+def tracker_actuals(fname):
+    """
+    Returns the reported US state values of each scored metric as
+    (IHME location names, days, {metric: location x date array}).
+    """
+
+    matrix = get_matrix_ctrack(fname, ['death', 'hospitalizedCurrently',
+                                       'hospitalizedCumulative'])
+    names = locations.translate(matrix['states'], 'ihme', 'postal')
+    values = {'totdea': matrix['death'],
+              'deaths': daily_change(matrix['death']),
+              'allbed': matrix['hospitalizedCurrently'],
+              'admis': daily_change(matrix['hospitalizedCumulative'])}
+
+    return names, matrix['days'], values
+
+
+def c19_actuals(fname):
+    """
+    Returns the reported country deaths of the CSSE time series as
+    (IHME location names, days, {metric: location x date array}).
+    """
+
+    data = cached_columns(fname, load_c19_columns, c19_version)
+    names = locations.translate(data['countries'], 'ihme', 'csse')
+    deaths = data['country_national'].astype(float)
+    values = {'totdea': deaths, 'deaths': daily_change(deaths)}
+
+    return names, to_days(data['dates']), values
+
+
+def align_actuals(locations, dates, metrics, sources):
+    """
+    Scatters the reported values of each source (see tracker_actuals) onto
+    a location x date x metric array on the given axes. Entries without a
+    reported value are NaN; later sources overwrite earlier ones.
+    """
+
+    location_index = {name: ind for ind, name in enumerate(locations)}
+    out = np.full((len(locations), len(dates), len(metrics)), np.nan)
+    for names, days, values in sources:
+        loc_inds = np.array([location_index.get(name, -1) for name in names], dtype = int)
+        day_inds = (days - dates[0]).astype(int)
+        keep_loc = loc_inds >= 0
+        keep_day = (day_inds >= 0) & (day_inds < len(dates))
+        for ind, metric in enumerate(metrics):
+            if metric in values:
+                rows = values[metric][keep_loc][:, keep_day]
+                out[np.ix_(loc_inds[keep_loc], day_inds[keep_day], [ind])] = rows[..., np.newaxis]
+
+    return out
+
+
+def score_forecasts(mean, lower, upper, actual, release_day, dates,
+                    min_horizon = 1, max_horizon = None):
+    """
+    Scores release x location x date x metric projections against a
+    location x date x metric array of reported values. Returns a dictionary
+    of release x location x metric arrays ("n", "mae", "bias", "coverage"),
+    "horizon_mae" (release x location x metric x horizon) and "horizons".
+    Days min_horizon to max_horizon after each release are scored.
+    """
+
+    horizon = (dates[np.newaxis, :] - release_day[:, np.newaxis]).astype(int)
+    if max_horizon is None:
+        max_horizon = max(int(horizon.max()), min_horizon)
+
+    in_window = (horizon >= min_horizon) & (horizon <= max_horizon)
+    actual = actual[np.newaxis]
+    scored = (in_window[:, np.newaxis, :, np.newaxis] &
+              ~np.isnan(actual) & ~np.isnan(mean))
+
+    err = np.where(scored, mean - actual, 0.)
+    n = scored.sum(axis = 2)
+    inside = scored & (actual >= lower) & (actual <= upper)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        out = {'n': n,
+               'mae': np.abs(err).sum(axis = 2)/n,
+               'bias': err.sum(axis = 2)/n,
+               'coverage': inside.sum(axis = 2)/n}
+
+    # Mean absolute error by horizon from one weighted bincount
+    n_rel, n_loc, n_days, n_met = mean.shape
+    n_hor = max_horizon - min_horizon + 1
+    h_ind = np.clip(horizon - min_horizon, 0, n_hor - 1)
+    bins = ((np.arange(n_rel)[:, None, None, None]*n_loc +
+             np.arange(n_loc)[None, :, None, None])*n_met +
+            np.arange(n_met)[None, None, None, :])*n_hor + h_ind[:, None, :, None]
+    bins = np.broadcast_to(bins, scored.shape)[scored]
+    size = n_rel*n_loc*n_met*n_hor
+    abs_sum = np.bincount(bins, weights = np.abs(err[scored]), minlength = size)
+    counts = np.bincount(bins, minlength = size)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        out['horizon_mae'] = (abs_sum/counts).reshape(n_rel, n_loc, n_met, n_hor)
+    out['horizons'] = np.arange(min_horizon, max_horizon + 1)
+
+    return out
+
+
+def score_table(scores, releases, locations, metrics):
+    """
+    Flattens release x location x metric scores into a structured array
+    with one row per scored combination (n > 0).
+    """
+
+    shape = scores['n'].shape
+    rel, loc, met = np.indices(shape).reshape(3, -1)
+    keep = scores['n'].ravel() > 0
+
+    str_width = lambda names: max([len(name) for name in names] + [1])
+    table = np.zeros(keep.sum(), dtype = [('release', 'U%i' % str_width(releases)),
+                                          ('location', 'U%i' % str_width(locations)),
+                                          ('metric', 'U%i' % str_width(metrics)),
+                                          ('n', np.int32), ('mae', np.float64),
+                                          ('bias', np.float64), ('coverage', np.float64)])
+    table['release'] = np.asarray(releases)[rel[keep]]
+    table['location'] = np.asarray(locations)[loc[keep]]
+    table['metric'] = np.asarray(metrics)[met[keep]]
+    for key in ['n', 'mae', 'bias', 'coverage']:
+        table[key] = scores[key].ravel()[keep]
+
+    return table
+
+
+def score_cube(cube, ctrack_fname = None, c19_fname = None, metrics = score_metrics,
+               min_horizon = 1, max_horizon = None):
+    """
+    Scores every release of an ihme_cube against the Covid Tracking and/or
+    CSSE files given. Returns (table, scores); see score_table and
+    score_forecasts. Metrics missing from the cube are skipped.
+    """
+
+    metrics = [metric for metric in metrics
+               if all('%s_%s' % (metric, stat) in cube.metric_index
+                      for stat in ('mean', 'lower', 'upper'))]
+    sources = list()
+    if ctrack_fname is not None:
+        sources.append(tracker_actuals(ctrack_fname))
+    if c19_fname is not None:
+        sources.append(c19_actuals(c19_fname))
+    actual = align_actuals(cube.locations, cube.dates, metrics, sources)
+
+    stats = dict()
+    for stat in ('mean', 'lower', 'upper'):
+        inds = [cube.metric_index['%s_%s' % (metric, stat)] for metric in metrics]
+        stats[stat] = np.asarray(cube.data[..., inds], dtype = float)
+
+    scores = score_forecasts(stats['mean'], stats['lower'], stats['upper'], actual,
+                             release_days(cube.releases), cube.dates,
+                             min_horizon, max_horizon)
+    scores.update({'releases': list(cube.releases), 'locations': list(cube.locations),
+                   'metrics': metrics})
+
+    return score_table(scores, cube.releases, cube.locations, metrics), scores
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+
+Multi-release ("vintage") cube of IHME projections.
+
+Every IHME release found in "../data/ihme" is loaded once and scattered into
+a single dense array with axes
+
+    release x location x date x metric
+
+aligned on a shared daily calendar, with NaN wherever a release has no value
+for a location and date. The array is stored as a .npy file next to a JSON
+file holding the axis labels, and is opened memory-mapped so the full history
+is available without re-reading any CSV. For example, all releases of the
+New York daily death projections are
+
+    cube = get_ihme_cube('../cache/ihme_cube.npy')
+    cube.series('New York', 'deaths_mean')
+
+"""
+
+import os
+import json
+import zipfile
+import numpy as np
+
+import data_cache
+from data_cache import cached_columns
+from prefetch import prefetch
+from read_data import (load_ihme_columns, find_ihme_member, ihme_keyname,
+                       ihme_version)
+
+# Row-number columns that are not projections
+ihme_index_headers = ('', 'V1')
+
+
+def find_ihme_releases(ihme_dir):
+    """
+    Returns a list of (fname, member, release) tuples for each distinct IHME
+    release under ihme_dir, ordered by release. Extracted CSV files are used
+    where available; otherwise the CSV is read from the release zip archive.
+    """
+
+    releases = dict()
+    for name in sorted(os.listdir(ihme_dir)):
+        path = os.path.join(ihme_dir, name, 'Hospitalization_all_locs.csv')
+        if os.path.isfile(path):
+            releases[name] = (path, None, name)
+
+    for name in sorted(os.listdir(ihme_dir)):
+        path = os.path.join(ihme_dir, name)
+        if not (name.endswith('.zip') and zipfile.is_zipfile(path)):
+            continue
+        with zipfile.ZipFile(path) as archive:
+            member = find_ihme_member(archive)
+        release = member.split('/')[0]
+        if release not in releases:
+            releases[release] = (path, member, release)
+
+    return [releases[key] for key in sorted(releases)]
+
+
+class ihme_cube:
+    """
+    Memory-mapped release x location x date x metric array of IHME
+    projections along with its axis labels.
+    """
+
+    def __init__(self, fname):
+        """
+        Open a cube written by build_ihme_cube. The array is mapped read-only.
+        """
+
+        with open(meta_name(fname), 'rt') as fid:
+            meta = json.load(fid)
+
+        self.fname = fname
+        self.sources = meta['sources']
+        self.releases = meta['releases']
+        self.locations = meta['locations']
+        self.metrics = meta['metrics']
+        self.dates = (np.datetime64(meta['start_date'], 'D') +
+                      np.arange(meta['n_days']))
+        self.data = np.load(fname, mmap_mode = 'r')
+
+        self.release_index = {s: ind for ind, s in enumerate(self.releases)}
+        self.location_index = {s: ind for ind, s in enumerate(self.locations)}
+        self.metric_index = {s: ind for ind, s in enumerate(self.metrics)}
+
+    def series(self, location, metric):
+        """
+        Returns the release x date array of one metric for one location.
+        """
+
+        return self.data[:, self.location_index[location], :,
+                         self.metric_index[metric]]
+
+    def release(self, release):
+        """
+        Returns the location x date x metric array for one release.
+        """
+
+        return self.data[self.release_index[release]]
+
+
+def meta_name(fname):
+    """
+    Returns the name of the JSON file holding a cube's axis labels.
+    """
+
+    return os.path.splitext(fname)[0] + '.json'
+
+
+def source_stamps(releases):
+    """
+    Returns [fname, member, size, mtime] for each release source so stale
+    cubes can be detected.
+    """
+
+    stamps = list()
+    for fname, member, release in releases:
+        stat = os.stat(fname)
+        stamps.append([os.path.abspath(fname), member, stat.st_size,
+                       stat.st_mtime_ns])
+
+    return stamps
+
+
+def build_ihme_cube(fname, releases, metrics = None, dtype = np.float32):
+    """
+    Builds the vintage cube for a list of (fname, member, release) tuples
+    (see find_ihme_releases) and writes it to fname (a .npy file). By
+    default all metrics common to every release are kept.
+    """
+
+    # Parse the releases concurrently into the column cache on multi-core machines
+    if data_cache.cache_enabled and (os.cpu_count() or 1) > 1:
+        for source, data, error in prefetch([release[:2] for release in releases],
+                                            load = False):
+            if error is not None:
+                raise error
+
+    # Parse each release once (through the column cache)
+    all_data = [cached_columns(source, load_ihme_columns, ihme_version, member)
+                for source, member, release in releases]
+
+    if metrics is None:
+        common = None
+        for data in all_data:
+            keys = [key for key, val in data.items()
+                    if val.dtype.kind == 'f' and key not in ihme_index_headers]
+            common = keys if common is None else [key for key in common if key in keys]
+        metrics = common or list()
+
+    # Shared location axis and calendar
+    locations = np.unique(np.concatenate([data[ihme_keyname(data)]
+                                          for data in all_data]))
+    all_days = [data['day'] for data in all_data]
+    start_date = min(days.min() for days in all_days)
+    stop_date = max(days.max() for days in all_days)
+    n_days = int((stop_date - start_date).astype(int)) + 1
+
+    shape = (len(releases), len(locations), n_days, len(metrics))
+    cube = np.lib.format.open_memmap(fname, mode = 'w+', dtype = dtype,
+                                     shape = shape)
+    cube[...] = np.nan
+
+    # Scatter each release's rows into its slab in one indexed assignment
+    for ind, (data, days) in enumerate(zip(all_data, all_days)):
+        loc_inds = np.searchsorted(locations, data[ihme_keyname(data)])
+        day_inds = (days - start_date).astype(int)
+        values = np.column_stack([data[metric] for metric in metrics])
+        cube[ind, loc_inds, day_inds, :] = values
+
+    cube.flush()
+    del cube
+
+    meta = {'releases': [release for source, member, release in releases],
+            'locations': locations.tolist(),
+            'metrics': list(metrics),
+            'start_date': str(start_date),
+            'n_days': n_days,
+            'sources': source_stamps(releases)}
+    with open(meta_name(fname), 'wt') as fid:
+        json.dump(meta, fid, indent = 1)
+
+    return ihme_cube(fname)
+
+
+def get_ihme_cube(fname, ihme_dir = os.path.join('..', 'data', 'ihme'),
+                  metrics = None):
+    """
+    Opens the vintage cube stored at fname, (re)building it first if it is
+    missing or any release under ihme_dir has been added or changed.
+    """
+
+    releases = find_ihme_releases(ihme_dir)
+    try:
+        cube = ihme_cube(fname)
+        if (cube.sources == source_stamps(releases) and
+            (metrics is None or list(metrics) == cube.metrics)):
+            return cube
+    except (OSError, ValueError, KeyError):
+        pass
+
+    directory = os.path.dirname(fname)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    return build_ihme_cube(fname, releases, metrics)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+
+Per-stage timing and memory instrumentation.
+
+Loaders and plotting entry points are wrapped with the timed decorator, and
+smaller blocks (e.g. savefig) with the stage context manager:
+
+    @timed('parse.ihme')
+    def read_ihme_columns(fid, locations = None):
+        ...
+
+    with stage('render.savefig'):
+        fig.savefig(fname)
+
+While instrumentation is off these cost one flag test per call. When it is
+on, every stage records its call count, total wall time and the peak memory
+allocated while it ran (through tracemalloc, relative to the memory in use
+when the stage started; nested stages count toward their parents).
+
+tracemalloc keeps a single, process-wide peak, so memory is only attributed
+to stages that run alone. When stages of different threads overlap (e.g.
+under prefetch(threads = True)), memory tracking is dropped for every stage
+open at the time and for the new one; their times are still recorded, and
+the report counts calls without a memory figure per stage as "untracked".
+
+Instrumentation is turned on by setting C19_PROFILE=1 in the environment or
+by calling enable(). With C19_PROFILE_REPORT=<file> the report is also
+written to that JSON file when the process exits. Reports from two runs can
+be diffed directly or compared with compare_reports.
+
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import functools
+import contextlib
+import tracemalloc
+from datetime import datetime
+
+enabled = False
+track_memory = True
+
+stats = dict()
+stats_lock = threading.Lock()
+frames = threading.local()
+open_frames = list()
+
+
+def enable(memory = True):
+    """
+    Turns instrumentation on; memory = False records times and counts only.
+    """
+
+    global enabled, track_memory
+    track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    enabled = True
+
+
+def disable():
+    """
+    Turns instrumentation off. Recorded statistics are kept.
+    """
+
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """
+    Clears the recorded statistics.
+    """
+
+    with stats_lock:
+        stats.clear()
+
+
+def stage_stack():
+    """
+    Returns this thread's stack of open stages.
+    """
+
+    if not hasattr(frames, 'stack'):
+        frames.stack = list()
+    return frames.stack
+
+
+def start_stage(name):
+    """
+    Opens a stage and returns its frame.
+    """
+
+    stack = stage_stack()
+    thread = threading.get_ident()
+    frame = {'name': name, 'thread': thread, 'peak': 0, 'start_mem': 0,
+             'memory': track_memory and tracemalloc.is_tracing()}
+    with stats_lock:
+        if any(other['thread'] != thread for other in open_frames):
+            # Stages overlap across threads: the shared peak means nothing
+            for other in open_frames:
+                other['memory'] = False
+            frame['memory'] = False
+        open_frames.append(frame)
+
+    if frame['memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # The parent's peak so far is lost when the peak is reset
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame['start_mem'] = current
+    stack.append(frame)
+    frame['start'] = time.perf_counter()
+    return frame
+
+
+def end_stage(frame):
+    """
+    Closes a stage and adds its time and memory to the statistics.
+    """
+
+    seconds = time.perf_counter() - frame['start']
+    stack = stage_stack()
+    stack.pop()
+    with stats_lock:
+        open_frames[:] = [other for other in open_frames if other is not frame]
+
+    peak_bytes = 0
+    if frame['memory'] and tracemalloc.is_tracing():
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        peak_bytes = peak - frame['start_mem']
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+    with stats_lock:
+        entry = stats.setdefault(frame['name'], {'calls': 0, 'seconds': 0.,
+                                                 'peak_bytes': 0, 'untracked': 0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['untracked'] += not frame['memory']
+        entry['peak_bytes'] = max(entry['peak_bytes'], peak_bytes)
+
+
+@contextlib.contextmanager
+def recorded_stage(name):
+    """
+    Records the enclosed block as stage "name" (see stage).
+    """
+
+    frame = start_stage(name)
+    try:
+        yield
+    finally:
+        end_stage(frame)
+
+
+null_stage = contextlib.nullcontext()
+
+
+def stage(name):
+    """
+    Context manager recording the enclosed block as stage "name".
+    """
+
+    if not enabled:
+        return null_stage
+    return recorded_stage(name)
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as stage "name".
+    """
+
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fun(*args, **kwargs)
+            frame = start_stage(name)
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                end_stage(frame)
+        return wrapper
+
+    return decorator
+
+
+def report():
+    """
+    Returns the recorded statistics as a dictionary, stages sorted by name.
+    """
+
+    with stats_lock:
+        stages = {name: {'calls': entry['calls'],
+                         'seconds': entry['seconds'],
+                         'peak_mb': entry['peak_bytes']/2**20,
+                         'untracked': entry['untracked']}
+                  for name, entry in sorted(stats.items())}
+
+    return {'meta': {'timestamp': datetime.now().isoformat(timespec = 'seconds'),
+                     'argv': sys.argv, 'pid': os.getpid(),
+                     'memory': track_memory},
+            'stages': stages}
+
+
+def write_report(fname):
+    """
+    Writes report() to a JSON file.
+    """
+
+    directory = os.path.dirname(fname)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(fname, 'wt') as fid:
+        json.dump(report(), fid, indent = 1)
+
+
+def print_report(out = None):
+    """
+    Prints the recorded statistics as a table.
+    """
+
+    out = sys.stdout if out is None else out
+    out.write('%-32s %8s %10s %10s %10s\n' % ('stage', 'calls', 'seconds', 'peak MB',
+                                                'untracked'))
+    for name, entry in report()['stages'].items():
+        out.write('%-32s %8i %10.4f %10.1f %10i\n' % (name, entry['calls'], entry['seconds'],
+                                                        entry['peak_mb'], entry['untracked']))
+
+
+def compare_reports(new, old, out = None):
+    """
+    Prints the change in time and peak memory of each stage between two
+    reports (dictionaries or JSON file names).
+    """
+
+    reports = list()
+    for rep in (new, old):
+        if isinstance(rep, str):
+            with open(rep, 'rt') as fid:
+                rep = json.load(fid)
+        reports.append(rep['stages'])
+    new, old = reports
+
+    out = sys.stdout if out is None else out
+    out.write('%-32s %10s %10s %10s %10s\n' % ('stage', 'old s', 'new s',
+                                                'old MB', 'new MB'))
+    for name in sorted(set(new) | set(old)):
+        a, b = old.get(name, {}), new.get(name, {})
+        out.write('%-32s %10.4f %10.4f %10.1f %10.1f\n' %
+                  (name, a.get('seconds', float('nan')), b.get('seconds', float('nan')),
+                   a.get('peak_mb', float('nan')), b.get('peak_mb', float('nan'))))
+
+
+if os.environ.get('C19_PROFILE', '') not in ('', '0'):
+    enable()
+    if os.environ.get('C19_PROFILE_REPORT'):
+        atexit.register(write_report, os.environ['C19_PROFILE_REPORT'])
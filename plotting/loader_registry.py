@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+
+Process-wide registry of parsed data files.
+
+Scripts that build many per-location objects from the same file (see
+sweden_comparisons.py) ask the registry instead of calling the readers in
+read_data.py directly. Each file is parsed once per process and every later
+request is served from memory:
+
+    death, dates = c19_country('Sweden', country_filename)
+    data = ctrack_state('NY', state_filename)
+
+Entries are keyed by loader, path, size and modification time, so editing a
+file reloads it. Only the max_files most recently used files are kept
+resident. The registry may be shared between threads; a file requested by
+several threads at once is still parsed only once.
+
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from read_data import get_data_ctrack, load_c19_columns, c19_version
+from data_cache import cached_columns
+
+
+class loader_registry:
+    """
+    Thread-safe LRU store of parsed files with hit and miss counters.
+    """
+
+    def __init__(self, max_files = 8):
+        """
+        Create an empty registry keeping at most max_files parsed files.
+        """
+
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.loading = dict()  # Per-key locks for files being parsed
+
+    def key(self, name, fname):
+        """
+        Returns the registry key of a file as read by loader "name".
+        """
+
+        stat = os.stat(fname)
+        return (name, os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)
+
+    def get(self, name, fname, loader):
+        """
+        Returns loader(fname), parsing the file only if the registry does not
+        already hold it.
+        """
+
+        key = self.key(name, fname)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                # Another thread may have finished parsing while we waited
+                if key in self.entries:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+                self.misses += 1
+
+            value = loader(fname)
+
+            with self.lock:
+                self.entries[key] = value
+                while len(self.entries) > self.max_files:
+                    self.entries.popitem(last = False)
+                self.loading.pop(key, None)
+
+        return value
+
+    def stats(self):
+        """
+        Returns a dictionary of the hit and miss counts and resident files.
+        """
+
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'files': [key[1] for key in self.entries]}
+
+    def clear(self):
+        """
+        Drops every resident file and resets the counters.
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Registry shared by the whole process
+registry = loader_registry()
+
+
+def load_ctrack_states(fname):
+    """
+    Returns the per-state dictionaries of a Covid Tracking file.
+    """
+
+    return get_data_ctrack(None, fname)
+
+
+def load_c19_index(fname):
+    """
+    Returns the indexed CSSE columns of a file along with a country to row
+    dictionary for constant time lookups.
+    """
+
+    data = cached_columns(fname, load_c19_columns, c19_version)
+    index = {country: ind for ind, country in enumerate(data['countries'].tolist())}
+    return data, index
+
+
+def ctrack_state(state, fname):
+    """
+    get_data_ctrack(state, fname) served from the registry. The arrays are
+    shared between callers and must not be modified.
+    """
+
+    return registry.get('ctrack', fname, load_ctrack_states)[state]
+
+
+def c19_country(country, fname, rollup = False):
+    """
+    get_data_c19(country, fname, rollup) served from the registry. The
+    arrays are shared between callers and must not be modified.
+    """
+
+    data, index = registry.get('c19', fname, load_c19_index)
+    if country not in index:
+        raise KeyError('Country "%s" not found in %s' % (country, fname))
+
+    key = 'country_total' if rollup else 'country_national'
+    return data[key][index[country]], data['dates']
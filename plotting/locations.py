@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+
+Location dimension table shared by the state, country and IHME readers.
+
+Each source names locations its own way: the Covid Tracking files use postal
+codes ("NY"), the CSSE time series use country names ("US") and IHME uses
+full names ("New York", "United States of America"). The table below holds
+one row per location with every spelling plus the FIPS code (as in the
+tracker "fips" column) and the population in millions. US states have no
+CSSE name, as the global CSSE series only lists countries.
+
+Names from one source should be resolved through that source's column, since
+the same spelling can name different locations in different sources (the
+CSSE country "Georgia" is not the IHME state "Georgia"):
+
+    locations.lookup('NY', 'ihme', source = 'postal')         # 'New York'
+    locations.lookup('US', 'population', source = 'csse')     # 328.2
+    locations.column_map('postal', 'ihme')          # {'AL': 'Alabama', ...}
+
+join_locations aligns reported series and IHME projections for any set of
+locations onto one daily grid. Names from every source are resolved to table
+rows with dictionary lookups, so no per-location string matching is needed:
+
+    joined = join_locations(['NY', 'CA', 'Sweden'],
+                            actuals = [tracker_actuals(tracker_file)],
+                            projections = [get_data_ihme(model_fname)])
+    joined['projected']['totdea_mean']          # location x date array
+
+"""
+
+import numpy as np
+
+from read_data import load_ctrack_columns, ctrack_version, int_column
+from data_cache import cached_columns
+from instrument import timed
+
+
+# kind, postal code, IHME name, CSSE name, FIPS, population (millions)
+location_rows = [
+    ('state', 'AL', 'Alabama', '', 1, 4.90),
+    ('state', 'AK', 'Alaska', '', 2, 0.73),
+    ('state', 'AZ', 'Arizona', '', 4, 7.28),
+    ('state', 'AR', 'Arkansas', '', 5, 3.02),
+    ('state', 'CA', 'California', '', 6, 39.51),
+    ('state', 'CO', 'Colorado', '', 8, 5.76),
+    ('state', 'CT', 'Connecticut', '', 9, 3.57),
+    ('state', 'DE', 'Delaware', '', 10, 0.97),
+    ('state', 'DC', 'District of Columbia', '', 11, 0.71),
+    ('state', 'FL', 'Florida', '', 12, 21.48),
+    ('state', 'GA', 'Georgia', '', 13, 10.62),
+    ('state', 'HI', 'Hawaii', '', 15, 1.42),
+    ('state', 'ID', 'Idaho', '', 16, 1.79),
+    ('state', 'IL', 'Illinois', '', 17, 12.67),
+    ('state', 'IN', 'Indiana', '', 18, 6.72),
+    ('state', 'IA', 'Iowa', '', 19, 3.16),
+    ('state', 'KS', 'Kansas', '', 20, 2.91),
+    ('state', 'KY', 'Kentucky', '', 21, 4.47),
+    ('state', 'LA', 'Louisiana', '', 22, 4.65),
+    ('state', 'ME', 'Maine', '', 23, 1.34),
+    ('state', 'MD', 'Maryland', '', 24, 6.05),
+    ('state', 'MA', 'Massachusetts', '', 25, 6.95),
+    ('state', 'MI', 'Michigan', '', 26, 9.9),
+    ('state', 'MN', 'Minnesota', '', 27, 5.64),
+    ('state', 'MS', 'Mississippi', '', 28, 2.98),
+    ('state', 'MO', 'Missouri', '', 29, 6.14),
+    ('state', 'MT', 'Montana', '', 30, 1.01),
+    ('state', 'NE', 'Nebraska', '', 31, 1.93),
+    ('state', 'NV', 'Nevada', '', 32, 3.08),
+    ('state', 'NH', 'New Hampshire', '', 33, 1.36),
+    ('state', 'NJ', 'New Jersey', '', 34, 8.88),
+    ('state', 'NM', 'New Mexico', '', 35, 2.10),
+    ('state', 'NY', 'New York', '', 36, 20.2),
+    ('state', 'NC', 'North Carolina', '', 37, 10.49),
+    ('state', 'ND', 'North Dakota', '', 38, 0.76),
+    ('state', 'OH', 'Ohio', '', 39, 11.69),
+    ('state', 'OK', 'Oklahoma', '', 40, 3.96),
+    ('state', 'OR', 'Oregon', '', 41, 4.22),
+    ('state', 'PA', 'Pennsylvania', '', 42, 12.8),
+    ('state', 'RI', 'Rhode Island', '', 44, 1.06),
+    ('state', 'SC', 'South Carolina', '', 45, 5.45),
+    ('state', 'SD', 'South Dakota', '', 46, 0.88),
+    ('state', 'TN', 'Tennessee', '', 47, 6.83),
+    ('state', 'TX', 'Texas', '', 48, 28.99),
+    ('state', 'UT', 'Utah', '', 49, 3.2),
+    ('state', 'VT', 'Vermont', '', 50, 0.62),
+    ('state', 'VA', 'Virginia', '', 51, 8.54),
+    ('state', 'WA', 'Washington', '', 53, 7.61),
+    ('state', 'WV', 'West Virginia', '', 54, 1.76),
+    ('state', 'WI', 'Wisconsin', '', 55, 5.82),
+    ('state', 'WY', 'Wyoming', '', 56, 0.78),
+    # Territories reported by the tracker but not modeled by IHME
+    ('territory', 'AS', '', 'American Samoa', 60, 0.06),
+    ('territory', 'GU', '', 'Guam', 66, 0.17),
+    ('territory', 'MP', '', 'Northern Mariana Islands', 69, 0.06),
+    ('territory', 'PR', '', 'Puerto Rico', 72, 3.19),
+    ('territory', 'VI', '', 'Virgin Islands', 78, 0.10),
+    ('country', '', 'Belgium', 'Belgium', -1, 11.46),
+    ('country', '', 'Canada', 'Canada', -1, 37.59),
+    ('country', '', 'Denmark', 'Denmark', -1, 5.6),
+    ('country', '', 'Finland', 'Finland', -1, 5.52),
+    ('country', '', 'France', 'France', -1, 67.),
+    ('country', '', 'Germany', 'Germany', -1, 83.02),
+    ('country', '', 'Italy', 'Italy', -1, 60.4),
+    ('country', '', 'Netherlands', 'Netherlands', -1, 17.3),
+    ('country', '', 'Norway', 'Norway', -1, 5.4),
+    ('country', '', 'Spain', 'Spain', -1, 47.),
+    ('country', '', 'Sweden', 'Sweden', -1, 10.2),
+    ('country', '', 'United Kingdom', 'United Kingdom', -1, 66.7),
+    ('country', '', 'United States of America', 'US', -1, 328.2)]
+
+location_columns = ('kind', 'postal', 'ihme', 'csse', 'fips', 'population')
+
+# Columns searched, in order, when resolving a location name
+name_columns = ('postal', 'csse', 'ihme')
+
+
+class location_table:
+    """
+    Location dimension table: one row per location, one array per column,
+    with hash indexes from every name column to the row.
+    """
+
+    def __init__(self, rows = location_rows):
+        """
+        Build the table from (kind, postal, ihme, csse, fips, population)
+        tuples. Empty names and negative FIPS codes mean "not available".
+        """
+
+        kind, postal, ihme, csse, fips, population = zip(*rows)
+        self.columns = {'kind': np.array(kind), 'postal': np.array(postal),
+                        'ihme': np.array(ihme), 'csse': np.array(csse),
+                        'fips': np.array(fips, dtype = np.int32),
+                        'population': np.array(population, dtype = float)}
+        self.build_index()
+
+    def build_index(self):
+        """
+        Rebuilds the name -> row dictionaries. Names are resolved by postal
+        code first, then CSSE name, then IHME name.
+        """
+
+        self.index = {column: {name: row for row, name in enumerate(self.columns[column])
+                               if name != ''}
+                      for column in name_columns}
+        self.index['fips'] = {int(fips): row for row, fips in enumerate(self.columns['fips'])
+                              if fips >= 0}
+        self.names = dict()
+        for column in reversed(name_columns):
+            self.names.update(self.index[column])
+
+    def __len__(self):
+        return len(self.columns['kind'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def row(self, name, column = None):
+        """
+        Returns the table row of a location name (any spelling, or only that
+        of "column"), or -1 if it is not in the table.
+        """
+
+        index = self.names if column is None else self.index[column]
+        return index.get(name, -1)
+
+    def rows(self, names, column = None):
+        """
+        Returns the table rows of a sequence of names as an int array; -1
+        marks names not in the table.
+        """
+
+        index = self.names if column is None else self.index[column]
+        return np.array([index.get(name, -1) for name in names], dtype = int)
+
+    def lookup(self, name, column, default = None, source = None):
+        """
+        Returns the "column" value of a location given by its "source"
+        spelling (any of its names if None), or default if the location or
+        value is not available.
+        """
+
+        row = self.row(name, source)
+        if row < 0:
+            return default
+
+        value = self.columns[column][row]
+        if value == '' or (column == 'fips' and value < 0):
+            return default
+        return value.item()
+
+    def translate(self, names, column, source = None):
+        """
+        Returns the "column" spelling of each name, given by its "source"
+        spelling (any of its names if None), as an array. Names not in the
+        table, or without that spelling, are passed through unchanged unless
+        they spell another location of the table, which would alias it; those
+        are returned as ''.
+        """
+
+        rows = self.rows(names, source)
+        out = np.array(names, dtype = object)
+        found = rows >= 0
+        values = self.columns[column][rows[found]]
+        keep = values != ''
+        out[np.flatnonzero(found)[keep]] = values[keep]
+
+        if source is not None:
+            # e.g. the CSSE country "Georgia" must not become the state
+            other = ~found & (self.rows(names) >= 0)
+            out[other] = ''
+
+        return out.astype(str)
+
+    def column_map(self, key, value, kind = None):
+        """
+        Returns {key: value} for the rows with a "key" entry, optionally only
+        rows of one kind ('state', 'territory' or 'country'). Rows without a
+        "value" entry are left out.
+        """
+
+        out = dict()
+        for row, name in enumerate(self.columns[key]):
+            if name == '' or (kind is not None and self.columns['kind'][row] != kind):
+                continue
+            val = self.columns[value][row]
+            if not (isinstance(val, np.str_) and val == ''):
+                out[name.item()] = val.item()
+
+        return out
+
+    def update_fips(self, fname):
+        """
+        Fills the FIPS column from the "fips" column of a Covid Tracking file.
+        Returns the number of rows changed.
+        """
+
+        columns = cached_columns(fname, load_ctrack_columns, ctrack_version)
+        states, first = np.unique(columns['state'], return_index = True)
+        fips = int_column(columns['fips'][first])
+        rows = self.rows(states, 'postal')
+        keep = rows >= 0
+        changed = int((self.columns['fips'][rows[keep]] != fips[keep]).sum())
+        self.columns['fips'][rows[keep]] = fips[keep]
+        self.build_index()
+
+        return changed
+
+
+# Table used by the plotting scripts
+locations = location_table()
+
+
+def location_keys(names, table = None):
+    """
+    Returns a hashable key per name: the table row for known locations (so
+    that "NY", "New York" match), otherwise the name itself.
+    """
+
+    table = locations if table is None else table
+    return [table.names.get(name, name) for name in names]
+
+
+@timed('join.locations')
+def join_locations(names, actuals = (), projections = (), fields = None,
+                   days = None, table = None):
+    """
+    Aligns reported series and projections for a list of locations on one
+    daily grid.
+
+    actuals are (names, days, {metric: location x date array}) tuples as
+    returned by forecast_scores.tracker_actuals; projections are
+    series_tables as returned by get_data_ihme. Location names of every
+    source may use any spelling in the table; later sources overwrite
+    earlier ones. fields selects the projection columns (default: all
+    numeric columns). days defaults to the span of all sources.
+
+    Returns a dictionary holding "names", "population" (NaN if unknown),
+    "days" (datetime64[D]), "actual" and "projected", the latter two
+    dictionaries of location x date arrays with NaN where no value exists.
+    """
+
+    table = locations if table is None else table
+    out_index = {key: ind for ind, key in enumerate(location_keys(names, table))}
+    rows = table.rows(names)
+    population = np.full(len(names), np.nan)
+    population[rows >= 0] = table['population'][rows[rows >= 0]]
+
+    def positions(source_names):
+        return np.array([out_index.get(key, -1) for key in location_keys(source_names, table)],
+                        dtype = int)
+
+    # Source locations and days mapped to output rows, one array each
+    sources = list()
+    for src_names, src_days, values in actuals:
+        loc = positions(src_names)
+        sources.append(('actual', loc[:, np.newaxis], src_days[np.newaxis, :], values))
+    for proj in projections:
+        counts = [stop - start for start, stop in (proj.bounds[key] for key in proj.locations)]
+        loc = np.repeat(positions(proj.locations), counts)
+        keys = fields if fields is not None else list(proj.columns)
+        values = {key: proj.column(key) for key in keys if key in proj.columns}
+        sources.append(('projected', loc, proj.column('day'), values))
+
+    if days is None:
+        spans = [(src_days.min(), src_days.max()) for _, _, src_days, _ in sources
+                 if src_days.size > 0]
+        start = min(span[0] for span in spans) if spans else np.datetime64('today', 'D')
+        stop = max(span[1] for span in spans) if spans else start - 1
+        days = np.arange(start, stop + 1, dtype = 'datetime64[D]')
+
+    out = {'names': list(names), 'population': population, 'days': days,
+           'actual': dict(), 'projected': dict()}
+    for side, loc, src_days, values in sources:
+        day = (src_days - days[0]).astype(int) if len(days) > 0 else src_days.astype(int)
+        loc, day = np.broadcast_arrays(loc, day)
+        keep = (loc >= 0) & (day >= 0) & (day < len(days))
+        for key, val in values.items():
+            if key not in out[side]:
+                out[side][key] = np.full((len(names), len(days)), np.nan)
+            out[side][key][loc[keep], day[keep]] = np.broadcast_to(val, keep.shape)[keep]
+
+    return out
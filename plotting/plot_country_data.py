@@ -20,13 +20,12 @@ Country data per COVID-19 Github:
 
 import os
 import numpy as np
-from scipy.integrate import solve_ivp
-from scipy.optimize import fsolve
-import matplotlib.pyplot as plt
 from datetime import date
 
 
-from read_data import get_data_c19, format_date_c19, get_data_ihme, format_date_ihme
+from read_data import get_data_c19, get_data_ihme, to_days, format_days, date_slice
+from locations import locations
+from instrument import timed, stage
 
 
 
@@ -42,7 +41,8 @@ country = 'US'
 
 
 # Set files which we're loading from and set data dates for display
-datapath = r'..\data\COVID-19\csse_covid_19_data\csse_covid_19_time_series'
+datapath = os.path.join('..', 'data', 'COVID-19', 'csse_covid_19_data', 
+                        'csse_covid_19_time_series')
 dataname = 'time_series_covid19_deaths_global.csv'
 data_filename = os.path.join(datapath, dataname)
 data_date = '29 April'
@@ -55,7 +55,7 @@ data_date = '29 April'
 #
 #model_fname = r'..\data\ihme-covid19_20200410\2020_04_09.04\Hospitalization_all_locs.csv'
 #project_date = '10 April'
-model_fname = r'..\data\ihme\2020_04_16.05\Hospitalization_all_locs.csv'
+model_fname = os.path.join('..', 'data', 'ihme', '2020_04_16.05', 'Hospitalization_all_locs.csv')
 project_date = '17 April'
 
 # project_date = '31 March'
@@ -66,87 +66,114 @@ stop_date = '20200601'
 # Savenames for images
 today = date.today()
 impath = '../images/ihme_compare'
-imname = '%s_data%s_project%s_%s.png' % (country, data_date, project_date, str(today))
 
 
-# Load data and format
-death, dates = get_data_c19(country, data_filename)
-dates = [format_date_c19(s) for s in dates]
-date_inds = range(len(dates))        
-ddeath = np.diff(death, prepend = 0)
-
-xticks = date_inds[::4]
-xticklabels = ['%s/%s' % (s[-3], s[-2:]) for s in dates[::4]]
-
-# Load ihme data
-if country == 'US':
-    data_ihme = get_data_ihme(model_fname)['United States of America']
-else:
-    data_ihme = get_data_ihme(model_fname)[country]
-
-dates_ihme = [format_date_ihme(s) for s in data_ihme['date']]
-start_c19 = dates.index(start_date)
-dates = dates[start_c19:]
-death = death[start_c19:]
-ddeath = ddeath[start_c19:]
-
-start_ihme = dates_ihme.index(start_date)
-stop_ihme = dates_ihme.index(stop_date)
-
-dates_ihme = dates_ihme[start_ihme:stop_ihme]
-date_inds_ihme = range(len(dates_ihme))
-
-death_ihme_m, death_ihme_l, death_ihme_u = (data_ihme['totdea_mean'][start_ihme:stop_ihme], 
-                                                    data_ihme['totdea_lower'][start_ihme:stop_ihme], 
-                                                    data_ihme['totdea_upper'][start_ihme:stop_ihme])
-
-ddeath_ihme_m, ddeath_ihme_l, ddeath_ihme_u = (data_ihme['deaths_mean'][start_ihme:stop_ihme], 
-                                                    data_ihme['deaths_lower'][start_ihme:stop_ihme], 
-                                                    data_ihme['deaths_upper'][start_ihme:stop_ihme])
-
-xticks = date_inds_ihme[::4]
-xticklabels = ['%s/%s' % (s[-3], s[-2:]) for s in dates_ihme[::4]]
+@timed('metrics.country_series')
+def country_series(country, data_filename, model_fname, start_date, stop_date):
+    """
+    Loads the reported deaths for a country and the matching IHME death
+    projections, trimmed to the plotting window. Returns (series, proj)
+    dictionaries holding the dates, totals and daily values. Raises KeyError
+    if either source lacks the country.
+    """
+    
+    # Load data and format
+    death, dates = get_data_c19(country, data_filename)
+    days = to_days(dates)
+    dates = format_days(days)
+    ddeath = np.diff(death, prepend = 0)
+    
+    # Load ihme data; a CSSE name that spells another location (the country
+    # Georgia vs the state) has no IHME name
+    ihme_name = locations.translate([country], 'ihme', 'csse')[0]
+    all_ihme = get_data_ihme(model_fname, location = ihme_name) if ihme_name else {}
+    if ihme_name not in all_ihme:
+        raise KeyError('No IHME projections for "%s" in %s' % (country, model_fname))
+    data_ihme = all_ihme[ihme_name]
+    
+    keep_c19 = date_slice(days, start_date)
+    series = {'dates': dates[keep_c19], 'death': death[keep_c19], 
+              'ddeath': ddeath[keep_c19]}
+    
+    keep_ihme = date_slice(data_ihme['day'], start_date, stop_date)
+    proj = {'dates': format_days(data_ihme['day'][keep_ihme])}
+    for key, name in [('death', 'totdea'), ('ddeath', 'deaths')]:
+        proj[key] = (data_ihme[name + '_mean'][keep_ihme], 
+                     data_ihme[name + '_lower'][keep_ihme], 
+                     data_ihme[name + '_upper'][keep_ihme])
+    
+    return series, proj
 
 
 #%% Show info on hospitalizations
 
-lightblue = [0.3, 0.3, 0.8]
-darkblue = [0.2, 0.2, 0.6]
-fig, ax = plt.subplots(2, 1, figsize = (12, 6))
-ax = ax.flatten()
-
-ax = [None, ax[0], None, ax[1]]
-
-ax[1].plot(dates, death, 'o', label = 'Reported',
-            color = darkblue, markerfacecolor = lightblue)
-ax[1].plot(dates_ihme, death_ihme_m, 'k-', label = 'IHME Projected [Mean]')
-ax[1].plot(dates_ihme, death_ihme_l, 'r--', label = 'IHME Projected [Lower CI]')
-ax[1].plot(dates_ihme, death_ihme_u, 'r--', label = 'IHME Projected [Upper CI]')
-ax[1].set_xlim(0, date_inds_ihme[-1])
-ax[1].set_xticks(xticks)
-ax[1].set_xticklabels(xticklabels)
-ax[1].legend()
-ax[1].set_ylabel('Total Deaths', fontsize = 12, fontweight = 'bold')
-#ax[1].set_title('Deaths', fontsize = 12, fontweight = 'bold')
-
-
-ax[3].plot(dates, ddeath, 'o',
-           color = darkblue, markerfacecolor = lightblue)
-ax[3].plot(dates_ihme, ddeath_ihme_m, 'k-')
-ax[3].plot(dates_ihme, ddeath_ihme_l, 'r--')
-ax[3].plot(dates_ihme, ddeath_ihme_u, 'r--')
-ax[3].set_xlim(0, date_inds_ihme[-1])
-ax[3].set_xticks(xticks)
-ax[3].set_xticklabels(xticklabels)
-ax[3].set_ylabel('New Deaths', fontsize = 12, fontweight = 'bold')
-ax[3].set_xlabel('Date', fontsize = 12, fontweight = 'bold')
-
-# plt.tight_layout()
-fig.suptitle('%s: Reported Data [%s] vs IHME Projections [%s]' % 
-             (country, data_date, project_date), fontsize = 14, fontweight = 'bold')
-
-plt.savefig(os.path.join(impath, imname), bbox_inches = 'tight')
-
-
+@timed('render.country')
+def plot_country_figure(country, series, proj, data_date, project_date, 
+                        impath = '../images/ihme_compare', today = None):
+    """
+    Plots reported total and new deaths for a country against the IHME
+    projections and saves the figure to impath. Returns (fig, path).
+    """
+    
+    import matplotlib.pyplot as plt
+    
+    if today is None:
+        today = date.today()
+    imname = '%s_data%s_project%s_%s.png' % (country, data_date, project_date, str(today))
+    
+    dates, death, ddeath = series['dates'], series['death'], series['ddeath']
+    dates_ihme = proj['dates']
+    date_inds_ihme = range(len(dates_ihme))
+    death_ihme_m, death_ihme_l, death_ihme_u = proj['death']
+    ddeath_ihme_m, ddeath_ihme_l, ddeath_ihme_u = proj['ddeath']
+    
+    xticks = date_inds_ihme[::4]
+    xticklabels = ['%s/%s' % (s[-3], s[-2:]) for s in dates_ihme[::4]]
+    
+    lightblue = [0.3, 0.3, 0.8]
+    darkblue = [0.2, 0.2, 0.6]
+    fig, ax = plt.subplots(2, 1, figsize = (12, 6))
+    ax = ax.flatten()
+    
+    ax = [None, ax[0], None, ax[1]]
+    
+    ax[1].plot(dates, death, 'o', label = 'Reported',
+                color = darkblue, markerfacecolor = lightblue)
+    ax[1].plot(dates_ihme, death_ihme_m, 'k-', label = 'IHME Projected [Mean]')
+    ax[1].plot(dates_ihme, death_ihme_l, 'r--', label = 'IHME Projected [Lower CI]')
+    ax[1].plot(dates_ihme, death_ihme_u, 'r--', label = 'IHME Projected [Upper CI]')
+    ax[1].set_xlim(0, date_inds_ihme[-1])
+    ax[1].set_xticks(xticks)
+    ax[1].set_xticklabels(xticklabels)
+    ax[1].legend()
+    ax[1].set_ylabel('Total Deaths', fontsize = 12, fontweight = 'bold')
+    #ax[1].set_title('Deaths', fontsize = 12, fontweight = 'bold')
+    
+    
+    ax[3].plot(dates, ddeath, 'o',
+               color = darkblue, markerfacecolor = lightblue)
+    ax[3].plot(dates_ihme, ddeath_ihme_m, 'k-')
+    ax[3].plot(dates_ihme, ddeath_ihme_l, 'r--')
+    ax[3].plot(dates_ihme, ddeath_ihme_u, 'r--')
+    ax[3].set_xlim(0, date_inds_ihme[-1])
+    ax[3].set_xticks(xticks)
+    ax[3].set_xticklabels(xticklabels)
+    ax[3].set_ylabel('New Deaths', fontsize = 12, fontweight = 'bold')
+    ax[3].set_xlabel('Date', fontsize = 12, fontweight = 'bold')
+    
+    # plt.tight_layout()
+    fig.suptitle('%s: Reported Data [%s] vs IHME Projections [%s]' % 
+                 (country, data_date, project_date), fontsize = 14, fontweight = 'bold')
+    
+    with stage('render.savefig'):
+        fig.savefig(os.path.join(impath, imname), bbox_inches = 'tight')
+    
+    return fig, os.path.join(impath, imname)
 
 
+if __name__ == '__main__':
+    
+    series, proj = country_series(country, data_filename, model_fname, 
+                                  start_date, stop_date)
+    plot_country_figure(country, series, proj, data_date, project_date, 
+                        impath = impath, today = today)
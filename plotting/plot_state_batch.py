@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+
+Batch version of plot_state_data.py: renders the testing and IHME comparison
+figures for every US state (or a chosen subset) in one run.
+
+The Covid Tracking snapshot and the IHME release are each loaded once; the
+per-state series are then handed to a process pool that renders the figures
+with the non-interactive Agg backend. Each worker draws every state on one
+reused figure per layout (see figure_templates.py). Dates and output paths
+default to the settings at the top of plot_state_data.py; the tracker file
+defaults to the latest snapshot shipped in data/.
+
+With C19_PROFILE=1 a per-stage timing report is printed at the end (see
+instrument.py); stages run in worker processes are only recorded with
+processes = 1.
+
+"""
+
+import os
+import matplotlib
+matplotlib.use('Agg')
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+
+from read_data import get_data_ctrack, get_data_ihme
+import plot_state_data
+from plot_state_data import state_names, state_series, ihme_series
+from figure_templates import testing_template, hosp_death_template
+from render_manifest import render_manifest, fingerprint
+import instrument
+from instrument import timed
+
+# Latest Covid Tracking snapshot in data/ (plot_state_data.py names a newer
+# download that is not part of the repository)
+data_filename = os.path.join('..', 'data', 'covid19_tracker', 'states-daily_20200424.csv')
+data_date = '24 April'
+
+# Figure templates of this (worker) process, keyed by layout and options
+templates = dict()
+
+
+def get_template(key, factory, *args):
+    """
+    Returns this process' template for a layout, building it on first use.
+    """
+
+    if key not in templates:
+        templates[key] = factory(*args)
+
+    return templates[key]
+
+
+@timed('render.state')
+def render_state(job):
+    """
+    Renders the figures for one state on this process' templates. Runs in a
+    worker process; returns the list of image file names written.
+    """
+
+    state_long, series, proj, options = job
+    data_date, project_date = options['data_date'], options['project_date']
+    today = str(options['today'])
+
+    imnames = list()
+    if options['plot_testing']:
+        ylpct = options['ylpct']
+        template = get_template(('testing', None if ylpct is None else tuple(ylpct)),
+                                testing_template, ylpct)
+        template.update(state_long, series, proj)
+        imname = os.path.join(options['test_impath'], '%s_data%s_%s.png' %
+                              (state_long, data_date, today))
+        template.save(imname)
+        imnames.append(imname)
+
+    if options['plot_hosp_death']:
+        template = get_template('hosp_death', hosp_death_template)
+        template.update(state_long, series, proj, data_date, project_date)
+        imname = os.path.join(options['ihme_impath'], '%s_data%s_project%s_%s.png' %
+                              (state_long, data_date, project_date, today))
+        template.save(imname)
+        imnames.append(imname)
+
+    return imnames
+
+
+@timed('load.state_jobs')
+def state_jobs(data_filename, model_fname, states, start_date, stop_date):
+    """
+    Loads both files once and returns a (state_long, series, proj) tuple for
+    each requested state found in both. states defaults to every state in
+    state_names.
+    """
+
+    all_data = get_data_ctrack(None, data_filename)
+    if states is None:
+        states = list(state_names.keys())
+
+    names = [state_names[state] for state in states]
+    all_ihme = get_data_ihme(model_fname, location = names)
+
+    jobs = list()
+    for state, state_long in zip(states, names):
+        if state not in all_data or state_long not in all_ihme:
+            print('Skipping %s: no data' % state)
+            continue
+        jobs.append((state_long, state_series(all_data[state], start_date),
+                     ihme_series(all_ihme[state_long], start_date, stop_date)))
+
+    return jobs
+
+
+@timed('run.render_states')
+def render_states(states = None,
+                  data_filename = data_filename,
+                  model_fname = plot_state_data.model_fname,
+                  data_date = data_date,
+                  project_date = plot_state_data.project_date,
+                  start_date = plot_state_data.start_date,
+                  stop_date = plot_state_data.stop_date,
+                  ylpct = plot_state_data.ylpct,
+                  plot_testing = True, plot_hosp_death = True,
+                  test_impath = '../images/test_data',
+                  ihme_impath = '../images/ihme_compare',
+                  processes = None, today = None, manifest = None, force = False):
+    """
+    Renders the state figures for a list of postal codes (all states by
+    default) using a pool of "processes" workers (one per core by default;
+    1 renders in this process). Returns the image file names written.
+    
+    If manifest names a render manifest file (see render_manifest.py),
+    figures whose plotted data and options are unchanged since they were
+    last rendered, and whose image still exists, are skipped unless force
+    is True.
+    """
+
+    if today is None:
+        today = date.today()
+
+    options = {'data_date': data_date, 'project_date': project_date,
+               'ylpct': ylpct, 'today': today,
+               'plot_testing': plot_testing, 'plot_hosp_death': plot_hosp_death,
+               'test_impath': test_impath, 'ihme_impath': ihme_impath}
+    jobs = [job + (options, ) for job in
+            state_jobs(data_filename, model_fname, states, start_date, stop_date)]
+
+    if manifest is not None:
+        manifest = render_manifest(manifest)
+        jobs, prints = stale_jobs(jobs, manifest, force)
+
+    if processes == 1:
+        results = [render_state(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            results = list(pool.map(render_state, jobs))
+
+    if manifest is not None:
+        for job_prints, imnames in zip(prints, results):
+            for (key, fp), imname in zip(job_prints, imnames):
+                manifest.record(key, fp, imname)
+        manifest.save()
+
+    return [imname for imnames in results for imname in imnames]
+
+
+def figure_prints(job):
+    """
+    Returns the manifest key and fingerprint of the testing and IHME
+    comparison figures of a job. Each fingerprint covers only the data and
+    options drawn in that figure.
+    """
+
+    state_long, series, proj, options = job
+    testing = fingerprint('testing', state_long, series['dates'], series['dpos'],
+                          series['dneg'], proj['dates'], options['data_date'],
+                          options['ylpct'])
+    hosp_death = fingerprint('hosp_death', state_long, series, proj,
+                             options['data_date'], options['project_date'])
+
+    return {'plot_testing': ('testing|%s|%s' % (options['test_impath'], state_long),
+                             testing),
+            'plot_hosp_death': ('hosp_death|%s|%s' % (options['ihme_impath'], state_long),
+                                hosp_death)}
+
+
+def stale_jobs(jobs, manifest, force = False):
+    """
+    Drops the figures of each job that the manifest shows are up to date.
+    Returns the remaining jobs and, for each, the (key, fingerprint) of the
+    figures it will render, in rendering order.
+    """
+
+    out_jobs, out_prints = list(), list()
+    for job in jobs:
+        options = dict(job[-1])
+        job_prints = list()
+        for flag, (key, fp) in figure_prints(job).items():
+            if not options[flag]:
+                continue
+            if not force and manifest.is_current(key, fp):
+                options[flag] = False
+            else:
+                job_prints.append((key, fp))
+
+        if job_prints:
+            out_jobs.append(job[:-1] + (options, ))
+            out_prints.append(job_prints)
+
+    return out_jobs, out_prints
+
+
+if __name__ == '__main__':
+
+    imnames = render_states(manifest = os.path.join('..', 'images', 'render_manifest.json'))
+    print('Wrote %i figures' % len(imnames))
+    if instrument.enabled:
+        instrument.print_report()
@@ -20,13 +20,12 @@ State-level data per Covid tracking project:
 
 import os
 import numpy as np
-from scipy.integrate import solve_ivp
-from scipy.optimize import fsolve
-import matplotlib.pyplot as plt
 from datetime import date
-from scipy.signal import medfilt
 
-from read_data import get_data_ctrack, get_data_ihme, format_date_ihme
+from read_data import get_data_ctrack, get_data_ihme, date_slice, format_days
+from rolling import rolling_mean, rolling_ratio
+from instrument import timed, stage
+from locations import locations
 
 
 
@@ -51,7 +50,7 @@ def intfun(s):
 #state = 'IA'
 #state_long = 'Iowa'
 state = 'AL'
-state_long = 'Alabama'
+state_long = locations.lookup(state, 'ihme', source = 'postal')
 #state = 'OR'
 #state_long = 'Oregon'
 #state = 'FL'
@@ -82,8 +81,11 @@ state_long = 'Alabama'
 #state_long = 'Colorado'
 ylpct = [0., 30.]
 
+# Tracker postal codes and the matching IHME location names
+state_names = locations.column_map('postal', 'ihme', kind = 'state')
+
 # Set files which we're loading from and set data dates for display
-data_filename = r'..\data\covid19_tracker\states-daily_20200504.csv'
+data_filename = os.path.join('..', 'data', 'covid19_tracker', 'states-daily_20200504.csv')
 data_date = '04 May'
 
 #model_fname = r'..\data\ihme\2020_03_31.1\Hospitalization_all_locs.csv'
@@ -92,7 +94,7 @@ data_date = '04 May'
 #model_fname = r'..\data\ihme\2020_04_12.02\Hospitalization_all_locs.csv'
 #project_date = '13 April'
 
-model_fname = r'..\data\ihme\2020_04_16.05\Hospitalization_all_locs.csv'
+model_fname = os.path.join('..', 'data', 'ihme', '2020_04_16.05', 'Hospitalization_all_locs.csv')
 project_date = '17 April'
 
 # When to stop the plotting
@@ -104,73 +106,79 @@ plot_testing = True
 plot_hosp_death = True
 today = date.today()
 
-# Load data and format
-data = get_data_ctrack(state, data_filename)
-
-dates = data['date']
-start_date_ind = list(dates).index(start_date)
-dates = dates[start_date_ind:]
-pos = data['positive']
-neg = data['negative']
-hosp = data['hospitalizedCurrently']
-icu = data['inIcuCurrently']
-vent = data['onVentilatorCurrently']
-death = data['death']
-date_inds = range(len(dates))        
-  
-dpos = np.diff(pos, prepend = 0)
-dneg = np.diff(neg, prepend = 0)
-dhosp = np.diff(hosp, prepend = 0.)
-ddhosp = np.diff(dhosp, prepend = 0)
-ddeath = np.diff(death, prepend = 0)
-
-pos = pos[start_date_ind:]
-neg = neg[start_date_ind:]
-hosp = hosp[start_date_ind:]
-death = death[start_date_ind:]
-
-dpos = dpos[start_date_ind:]
-dneg = dneg[start_date_ind:]
-dhosp = dhosp[start_date_ind:]
-ddeath = ddeath[start_date_ind:]
-
-
-xticks = date_inds[::4]
-xticklabels = ['%s/%s' % (s[-3], s[-2:]) for s in dates[::4]]
-
-# Load ihme data
-data_ihme = get_data_ihme(model_fname)[state_long]
-dates_ihme = [format_date_ihme(s) for s in data_ihme['date']]
-
-# Trim to desired range
-start_ihme = dates_ihme.index(start_date)
-stop_ihme = dates_ihme.index(stop_date)
-dates_ihme = dates_ihme[start_ihme:stop_ihme]
-date_inds_ihme = range(len(dates_ihme))
-
-dhosp_ihme_m, dhosp_ihme_l, dhosp_ihme_u = (data_ihme['admis_mean'][start_ihme:stop_ihme], 
-                                                    data_ihme['admis_lower'][start_ihme:stop_ihme], 
-                                                    data_ihme['admis_upper'][start_ihme:stop_ihme])
-
-hosp_ihme_m, hosp_ihme_l, hosp_ihme_u = (data_ihme['allbed_mean'][start_ihme:stop_ihme], 
-                                                    data_ihme['allbed_lower'][start_ihme:stop_ihme], 
-                                                    data_ihme['allbed_upper'][start_ihme:stop_ihme])
-
-death_ihme_m, death_ihme_l, death_ihme_u = (data_ihme['totdea_mean'][start_ihme:stop_ihme], 
-                                                    data_ihme['totdea_lower'][start_ihme:stop_ihme], 
-                                                    data_ihme['totdea_upper'][start_ihme:stop_ihme])
-
-ddeath_ihme_m, ddeath_ihme_l, ddeath_ihme_u = (data_ihme['deaths_mean'][start_ihme:stop_ihme], 
-                                                    data_ihme['deaths_lower'][start_ihme:stop_ihme], 
-                                                    data_ihme['deaths_upper'][start_ihme:stop_ihme])
-
-xticks = date_inds_ihme[::4]
-xticklabels = ['%s/%s' % (s[-3], s[-2:]) for s in dates_ihme[::4]]
 
-#%% Data on tests
+@timed('metrics.state_series')
+def state_series(data, start_date):
+    """
+    Trims Covid Tracking data for one state to start at start_date and 
+    computes the daily changes. Returns a dictionary of series.
+    """
+    
+    keep = date_slice(data['day'], start_date)
+    pos = data['positive']
+    neg = data['negative']
+    hosp = data['hospitalizedCurrently']
+    death = data['death']
+      
+    dpos = np.diff(pos, prepend = 0)
+    dneg = np.diff(neg, prepend = 0)
+    dhosp = np.diff(hosp, prepend = 0.)
+    ddeath = np.diff(death, prepend = 0)
+    
+    return {'dates': data['date'][keep],
+            'pos': pos[keep], 'neg': neg[keep], 
+            'hosp': hosp[keep], 'death': death[keep],
+            'dpos': dpos[keep], 'dneg': dneg[keep],
+            'dhosp': dhosp[keep], 'ddeath': ddeath[keep]}
+
+
+@timed('metrics.ihme_series')
+def ihme_series(data_ihme, start_date, stop_date):
+    """
+    Trims IHME projections for one location to [start_date, stop_date). 
+    Returns a dictionary holding the dates and (mean, lower, upper) tuples.
+    """
+    
+    keep_ihme = date_slice(data_ihme['day'], start_date, stop_date)
+    out = {'dates': format_days(data_ihme['day'][keep_ihme])}
+    for key, name in [('dhosp', 'admis'), ('hosp', 'allbed'), 
+                      ('death', 'totdea'), ('ddeath', 'deaths')]:
+        out[key] = (data_ihme[name + '_mean'][keep_ihme], 
+                    data_ihme[name + '_lower'][keep_ihme], 
+                    data_ihme[name + '_upper'][keep_ihme])
+    
+    return out
 
 
-if plot_testing:
+def date_ticks(dates):
+    """
+    Returns tick positions and "m/dd" labels for every fourth date.
+    """
+    
+    xticks = range(len(dates))[::4]
+    xticklabels = ['%s/%s' % (s[-3], s[-2:]) for s in dates[::4]]
+    return xticks, xticklabels
+
+
+#%% Data on tests
+
+@timed('render.testing')
+def plot_testing_figure(state_long, series, proj, data_date, 
+                        impath = '../images/test_data', ylpct = None, 
+                        today = None):
+    """
+    Plots all tests, positive tests and the percentage of positive tests for
+    one state and saves the figure to impath. Returns the figure and the 
+    image file name.
+    """
+    
+    import matplotlib.pyplot as plt
+    
+    if today is None:
+        today = date.today()
+    dates, dpos, dneg = series['dates'], series['dpos'], series['dneg']
+    xticks, xticklabels = date_ticks(proj['dates'])
+    
     fig, ax = plt.subplots(1, 3, figsize = (17, 5))
     gray = 0.3*np.array([1, 1, 1])
     lightblue = [0.3, 0.3, 0.8]
@@ -180,7 +188,7 @@ if plot_testing:
     
     
     dtotal = dpos + dneg
-    avg_7 = medfilt(dtotal, 7)
+    avg_7 = rolling_mean(dtotal, 7)
     ax[0].plot(dates, dtotal, 'o', label = 'Total Tests', 
               color = darkblue, markerfacecolor = lightblue)
     ax[0].plot(dates, avg_7, 'k--', label = '7 Day Moving Average')
@@ -193,9 +201,7 @@ if plot_testing:
     ax[1].plot(dates, dpos, 'o', label = 'Positive Tests',
                 color = red, markerfacecolor = lightred)
     
-    avg_3 = medfilt(dpos, 3)
-    avg_7 = medfilt(dpos, 7)
-#    ax[1].plot(dates, avg_3, 'b--', label = '3 Day Moving Average')
+    avg_7 = rolling_mean(dpos, 7)
     ax[1].plot(dates, avg_7, 'k--', label = '7 Day Moving Average')
     
     ax[1].set_xticks(xticks)
@@ -203,9 +209,9 @@ if plot_testing:
     ax[1].set_ylabel('Number of Positives', fontsize = 12, fontweight = 'bold')
     ax[1].set_xlabel('Date', fontsize = 12, fontweight = 'bold')
 
-    avg_7 = medfilt(100*dpos/dtotal, 7)
+    avg_7 = 100*rolling_ratio(dpos, dtotal, 7)
     ax[2].plot(dates, avg_7, 'k--', label = '7 Day Moving Average')
-    ax[2].plot(dates, 100*dpos/dtotal, 'o', color = 'k',
+    ax[2].plot(dates, 100*rolling_ratio(dpos, dtotal, 1), 'o', color = 'k',
               markerfacecolor = gray)
     ax[2].set_xticks(xticks)
     ax[2].set_xticklabels(xticklabels)
@@ -240,16 +246,39 @@ if plot_testing:
              state_long, fontsize = 14, fontweight = 'bold')
     
     
-    impath = '../images/test_data'
     imname = '%s_data%s_%s.png' % (state_long, data_date, str(today))
-    plt.savefig(os.path.join(impath, imname), bbox_inches = 'tight')
+    with stage('render.savefig'):
+        fig.savefig(os.path.join(impath, imname), bbox_inches = 'tight')
+    
+    return fig, os.path.join(impath, imname)
 
 
 #%% Show info on hospitalizations and deaths
 
-if plot_hosp_death:
+@timed('render.hosp_death')
+def plot_hosp_death_figure(state_long, series, proj, data_date, project_date,
+                           impath = '../images/ihme_compare', today = None):
+    """
+    Plots reported hospitalizations and deaths for one state against the 
+    IHME projections and saves the figure to impath. Returns the figure and
+    the image file name.
+    """
+    
+    import matplotlib.pyplot as plt
+    
+    if today is None:
+        today = date.today()
+    dates = series['dates']
+    hosp, dhosp = series['hosp'], series['dhosp']
+    death, ddeath = series['death'], series['ddeath']
+    dates_ihme = proj['dates']
+    hosp_ihme_m, hosp_ihme_l, hosp_ihme_u = proj['hosp']
+    dhosp_ihme_m, dhosp_ihme_l, dhosp_ihme_u = proj['dhosp']
+    death_ihme_m, death_ihme_l, death_ihme_u = proj['death']
+    ddeath_ihme_m, ddeath_ihme_l, ddeath_ihme_u = proj['ddeath']
+    date_inds_ihme = range(len(dates_ihme))
+    xticks, xticklabels = date_ticks(dates_ihme)
     
-    impath = '../images/ihme_compare'
     imname = '%s_data%s_project%s_%s.png' % (state_long, data_date, project_date, str(today))
     
     lightblue = [0.3, 0.3, 0.8]
@@ -311,4 +340,26 @@ if plot_hosp_death:
     fig.suptitle('%s: Reported Data [%s] vs IHME Projections [%s]' % 
                  (state_long, data_date, project_date), fontsize = 14, fontweight = 'bold')
     
-    plt.savefig(os.path.join(impath, imname), bbox_inches = 'tight')
+    with stage('render.savefig'):
+        fig.savefig(os.path.join(impath, imname), bbox_inches = 'tight')
+    
+    return fig, os.path.join(impath, imname)
+
+
+if __name__ == '__main__':
+    
+    # Load data and format
+    data = get_data_ctrack(state, data_filename)
+    series = state_series(data, start_date)
+    
+    # Load ihme data and trim to desired range
+    data_ihme = get_data_ihme(model_fname, location = state_long)[state_long]
+    proj = ihme_series(data_ihme, start_date, stop_date)
+    
+    if plot_testing:
+        plot_testing_figure(state_long, series, proj, data_date, ylpct = ylpct,
+                            today = today)
+    
+    if plot_hosp_death:
+        plot_hosp_death_figure(state_long, series, proj, data_date, project_date,
+                               today = today)
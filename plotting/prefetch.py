@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+
+Concurrent loading of many tracker snapshots, CSSE files and IHME releases.
+
+prefetch takes a list of files (names, glob patterns, or (archive, member)
+pairs as returned by ihme_cube.find_ihme_releases) and parses them in a pool
+of worker processes, yielding each file's data as soon as it is ready:
+
+    for fname, data, error in prefetch('../data/covid19_tracker/states-daily_*.csv'):
+        if error is None:
+            ...data is the series_table get_data_ctrack(None, fname) returns...
+
+Workers parse each file into the column cache (see data_cache.py) and only
+send back its name; the main process then memory-maps the cache entry, so
+no parsed data is copied between processes. With the cache disabled the
+workers return the parsed data instead. At most max_pending files are
+queued or running at once, and results come back in completion order. A
+file that cannot be read or parsed is reported through "error" and the
+others carry on.
+
+Stages run in worker processes are not recorded by instrument.py.
+
+"""
+
+import os
+import glob
+import zipfile
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor, wait,
+                                FIRST_COMPLETED)
+
+import data_cache
+from data_cache import cached_columns
+from read_data import (load_ctrack_columns, ctrack_version, load_c19_columns,
+                       c19_version, load_ihme_columns, ihme_version,
+                       find_ihme_member, get_data_ctrack, get_data_ihme)
+
+
+def file_kind(fname):
+    """
+    Returns the source type of a data file from its name: 'ctrack' for
+    Covid Tracking snapshots, 'c19' for CSSE time series and 'ihme' for
+    anything else (IHME CSV files and release archives).
+    """
+
+    name = os.path.basename(fname)
+    if name.startswith('states-daily'):
+        return 'ctrack'
+    if name.startswith('time_series'):
+        return 'c19'
+    return 'ihme'
+
+
+def expand_sources(files):
+    """
+    Returns a list of (fname, member) sources for a file name, glob pattern
+    or (archive, member) pair, or a list of these, without duplicates. The
+    members of IHME archives given without one are filled in first, so an
+    archive listed both ways is loaded once.
+    """
+
+    if isinstance(files, (str, tuple)):
+        files = [files]
+
+    sources = list()
+    for item in files:
+        if isinstance(item, tuple):
+            sources.append(tuple(item[:2]))
+        elif glob.has_magic(item):
+            sources.extend((fname, None) for fname in sorted(glob.glob(item)))
+        else:
+            sources.append((item, None))
+
+    resolved = list()
+    for source in sources:
+        try:
+            source = resolve_member(source)
+        except (OSError, ValueError):
+            pass  # Left for the worker to report
+        resolved.append(source)
+
+    return list(dict.fromkeys(resolved))
+
+
+def data_sources(data_dir = os.path.join('..', 'data')):
+    """
+    Returns the sources of the whole data directory: every Covid Tracking
+    snapshot, every IHME release and the CSSE time series, if present.
+    """
+
+    from ihme_cube import find_ihme_releases
+
+    pattern = os.path.join(data_dir, 'covid19_tracker', 'states-daily_*.csv')
+    sources = [(fname, None) for fname in sorted(glob.glob(pattern))]
+    ihme_dir = os.path.join(data_dir, 'ihme')
+    if os.path.isdir(ihme_dir):
+        sources += [(fname, member) for fname, member, release
+                    in find_ihme_releases(ihme_dir)]
+    pattern = os.path.join(data_dir, 'COVID-19', 'csse_covid_19_data',
+                           'csse_covid_19_time_series', 'time_series_covid19_*_global.csv')
+    sources += [(fname, None) for fname in sorted(glob.glob(pattern))]
+
+    return sources
+
+
+def resolve_member(source):
+    """
+    Fills in the IHME CSV member of a release archive given without one.
+    """
+
+    fname, member = source
+    if member is None and file_kind(fname) == 'ihme' and zipfile.is_zipfile(fname):
+        with zipfile.ZipFile(fname) as archive:
+            member = find_ihme_member(archive)
+
+    return fname, member
+
+
+def warm_file(source):
+    """
+    Parses a (fname, member) source into the column cache, unless a current
+    entry exists. Returns the source with its archive member filled in.
+    """
+
+    fname, member = source = resolve_member(source)
+    kind = file_kind(fname)
+    if kind == 'ctrack':
+        cached_columns(fname, load_ctrack_columns, ctrack_version)
+    elif kind == 'c19':
+        cached_columns(fname, load_c19_columns, c19_version)
+    else:
+        cached_columns(fname, load_ihme_columns, ihme_version, member)
+
+    return source
+
+
+def load_file(source, columns = None, compact = False):
+    """
+    Returns the data of a (fname, member) source: the series_table of all
+    locations for tracker and IHME files (see get_data_ctrack and
+    get_data_ihme), or the load_c19_columns dictionary for CSSE files.
+    """
+
+    fname, member = source = resolve_member(source)
+    kind = file_kind(fname)
+    if kind == 'ctrack':
+        return get_data_ctrack(None, fname, columns, compact)
+    if kind == 'c19':
+        return cached_columns(fname, load_c19_columns, c19_version)
+
+    return get_data_ihme(fname, member, columns = columns, compact = compact)
+
+
+def fetch_file(source, warm_only, options):
+    """
+    Worker task: warms the cache entry of a source, or, with warm_only
+    False, loads and returns its data. Returns (source, data).
+    """
+
+    if warm_only:
+        return warm_file(source), None
+
+    source = resolve_member(source)
+    return source, load_file(source, **options)
+
+
+def init_worker(cache_dir, cache_enabled, max_cache_bytes):
+    """
+    Copies the parent's cache settings into a worker process.
+    """
+
+    data_cache.cache_dir = cache_dir
+    data_cache.cache_enabled = cache_enabled
+    data_cache.max_cache_bytes = max_cache_bytes
+
+
+def prefetch(files, workers = None, threads = False, max_pending = None,
+             columns = None, compact = False, load = True):
+    """
+    Loads many files concurrently, yielding (fname, data, error) for each as
+    it finishes; see the module docstring. data is what load_file returns
+    (None if load is False, which only fills the cache); error is the
+    exception raised for a malformed file, else None.
+
+    workers defaults to one per core. threads = True uses a thread pool
+    instead of processes. max_pending (default 2 per worker) bounds the
+    number of files submitted ahead of the consumer. columns and compact are
+    passed to the readers.
+    """
+
+    sources = expand_sources(files)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2*workers
+
+    # With the cache, workers only parse and the data is mapped here
+    warm = data_cache.cache_enabled
+    options = {'columns': columns, 'compact': compact}
+    if threads:
+        pool = ThreadPoolExecutor(max_workers = workers)
+    else:
+        pool = ProcessPoolExecutor(max_workers = workers, initializer = init_worker,
+                                   initargs = (data_cache.cache_dir, data_cache.cache_enabled,
+                                               data_cache.max_cache_bytes))
+
+    todo = iter(sources)
+    pending = dict()
+    try:
+        while True:
+            for source in todo:
+                pending[pool.submit(fetch_file, source, warm or not load, options)] = source
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            done = wait(pending, return_when = FIRST_COMPLETED)[0]
+            for future in done:
+                fname = pending.pop(future)[0]
+                try:
+                    source, data = future.result()
+                    if warm and load:
+                        data = load_file(source, **options)
+                except Exception as err:
+                    yield fname, None, err
+                else:
+                    yield fname, data, None
+    finally:
+        pool.shutdown(wait = True, cancel_futures = True)
@@ -15,8 +15,22 @@ to unify header titles for the read scripts below.
 
 """
 
+import io
+import csv
+import zipfile
+import itertools
+import contextlib
 import numpy as np
 
+from data_cache import cached_columns, cached_entry
+from series_table import series_table
+from instrument import timed
+
+# Bump these when a parser's output changes so stale cache entries are skipped
+ctrack_version = 2
+ihme_version = 2
+c19_version = 1
+
 def intfun(s):
     try:
         return int(s)
@@ -41,38 +55,218 @@ def foo(astr):
     
     return ''.join(items)
 
+
+def int_column(column):
+    """
+    Vectorized intfun: converts a column to int with blank entries as 0.
+    """
+    
+    if column.dtype.kind in 'iu':
+        return column
+    
+    try:
+        return np.where(column == '', '0', column).astype(int)
+    except ValueError:
+        return np.array([intfun(s) for s in column])
+
+
+def float_column(column):
+    """
+    Converts a column to float with blank entries as NaN.
+    """
+    
+    if column.dtype.kind in 'iuf':
+        return column.astype(float)
+    
+    return np.where(column == '', 'nan', column).astype(float)
+
+
+def compact_column(column):
+    """
+    Converts a numeric column to the compact dtypes: int32 counts (int64 if
+    out of range) and float32 values. String columns of numbers are parsed 
+    with blank entries masked (ints) or NaN (floats), rather than 0 as in 
+    int_column; other string columns are returned unchanged.
+    """
+    
+    kind = column.dtype.kind
+    if kind in 'iu':
+        info = np.iinfo(np.int32)
+        if len(column) == 0 or (column.min() >= info.min and column.max() <= info.max):
+            return column.astype(np.int32)
+        return column
+    if kind == 'f':
+        return column.astype(np.float32)
+    if kind != 'U':
+        return column
     
-def get_data_ctrack(state, fname):
+    blank = column == ''
+    try:
+        values = compact_column(np.where(blank, '0', column).astype(np.int64))
+        return np.ma.masked_array(values, mask = blank)
+    except ValueError:
+        pass
+    try:
+        return np.where(blank, 'nan', column).astype(np.float32)
+    except ValueError:
+        return column
+
+
+def compact_columns(data, labels):
+    """
+    Applies compact_column to every column of a dictionary except labels.
+    """
+    
+    return {key: val if key in labels else compact_column(val) 
+            for key, val in data.items()}
+
+
+def project_columns(data, columns, required):
+    """
+    Returns the entries of a column dictionary listed in columns or required
+    (all of them if columns is None). Names not in data are ignored, since
+    older files lack some columns.
+    """
+    
+    if columns is None:
+        return data
+    
+    keep = set(columns) | set(required)
+    return {key: val for key, val in data.items() if key in keep}
+
+
+@timed('parse.csv')
+def read_columns(fid, usecols = None):
+    """
+    Tokenizes an open CSV file in a single pass. Returns the list of headers
+    and a list of string arrays, one per column. If usecols is given only 
+    the columns with those headers are converted and returned.
+    """
+    
+    reader = csv.reader(fid)
+    headers = next(reader)
+    keep = [ind for ind, header in enumerate(headers) 
+            if usecols is None or header in usecols]
+    rows = [row for row in reader if row]
+    if len(rows) == 0:
+        return [headers[ind] for ind in keep], [np.array([], dtype = str) for ind in keep]
+    
+    columns = list(zip(*rows))
+    return [headers[ind] for ind in keep], [np.array(columns[ind]) for ind in keep]
+
+
+def infer_column(column):
+    """
+    Converts a string column to int if every entry parses as an integer;
+    otherwise the string column is returned unchanged.
+    """
+    
+    try:
+        return column.astype(int)
+    except ValueError:
+        return column
+
+
+@timed('group.rows')
+def group_rows(keys):
+    """
+    Builds a sort-based index of the rows sharing each key. Returns the
+    stable sort order of the rows, the sorted unique keys, and the offsets 
+    bounding each key's block of rows in sorted order.
+    """
+    
+    order = np.argsort(keys, kind = 'stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    offsets = np.concatenate(([0], starts, [len(keys)]))
+    if len(keys) == 0:
+        offsets = offsets[1:]
+    
+    return order, sorted_keys[offsets[:-1]], offsets
+
+
+# Columns kept in every projection of the Covid Tracking data
+ctrack_required = ('state', 'date', 'day')
+
+
+@timed('parse.ctrack')
+def load_ctrack_columns(fname, columns = None):
+    """
+    Reads a Covid Tracking CSV file once and picks each column's dtype from
+    its tokens. Returns a dictionary of arrays keyed by header; if columns
+    is given only those (and "state" and "date") are parsed.
+    """
+    
+    usecols = None if columns is None else set(columns) | set(ctrack_required)
+    with open(fname, 'rt') as fid:
+        headers, columns = read_columns(fid, usecols)
+    
+    return type_ctrack_columns(dict(zip(headers, columns)))
+
+
+def type_ctrack_columns(raw):
+    """
+    Converts a dictionary of Covid Tracking string columns to typed columns;
+    dates stay strings and other columns become int where possible.
+    """
+    
+    out = dict()
+    for header, column in raw.items():
+        if header == 'date':
+            out[header] = column
+            out['day'] = to_days(column)
+        else:
+            out[header] = infer_column(column)
+    
+    return out
+
+    
+@timed('load.ctrack')
+def get_data_ctrack(state, fname, columns = None, compact = False):
     """
     Returns dictionary of all data for the Covid Tracking dataset. This function
     applicable for data dated 4/2 and onwards.
     
-    If "state" argument is passed as None then a dictionary containing all
-    state data will be returned. 
+    If "state" argument is passed as None then a series_table holding all
+    state data, indexed by state like a dictionary, will be returned. 
+    
+    If "columns" is given (a list of headers) only those columns, plus 
+    "state", "date" and "day", are returned; unless the file is already 
+    cached, only they are parsed. With compact = True counts are int32 and
+    blank entries are masked instead of read as 0.
     """
     
-    # Get the headers
-    headers = np.loadtxt(fname, delimiter = ',', max_rows = 1, dtype = str, 
-                         unpack = True)
-    out = dict()
+    data = None
+    if columns is not None:
+        data = cached_entry(fname, ctrack_version)
+        if data is None:
+            data = load_ctrack_columns(fname, columns)
+    if data is None:
+        data = cached_columns(fname, load_ctrack_columns, ctrack_version)
     
-    for ind, header in enumerate(headers):
-        if header == 'date':
-            out[header] = np.loadtxt(fname, dtype = str, delimiter = ',', 
-               skiprows = 1, usecols = (ind, ), unpack = True)
-            continue
-        
-        try:
-            out[header] = np.loadtxt(fname, dtype = int, delimiter = ',', 
-                                     skiprows = 1, usecols = ind, unpack = True)
-        except ValueError:
-            out[header] = np.loadtxt(fname, dtype = str, delimiter = ',', 
-                                     skiprows = 1, usecols = (ind, ),
-                                     unpack = True)
+    return select_ctrack(state, data, columns, compact)
+
+
+@timed('select.ctrack')
+def select_ctrack(state, columns, fields = None, compact = False):
+    """
+    Filters typed Covid Tracking columns to one state, or groups them into a
+    series_table of all states if "state" is None; fields and compact are
+    the "columns" and "compact" options of get_data_ctrack. Count columns
+    missing from older snapshots are left out.
+    """
+    
+    out = dict(project_columns(columns, fields, ctrack_required))
             
     # List of items to convert to int
     convert_items = ['death', 'hospitalizedCurrently', 'hospitalized', 'positive', 'negative',
                      'inIcuCurrently', 'onVentilatorCurrently']
+    convert_items = [item for item in convert_items if item in out]
+    
+    # Compact columns keep blank counts masked rather than 0
+    if compact:
+        out = compact_columns(out, ctrack_label_headers)
+        convert_items = list()
 
     # Filter to state, if a state is provided
     if state is not None:
@@ -81,100 +275,384 @@ def get_data_ctrack(state, fname):
             out[key] = np.flip(val[state_inds])
         
         for item in convert_items:
-            out[item] = np.array([intfun(s) for s in out[item]])
+            out[item] = int_column(out[item])
         
         return out
     else:
-        # Otherwise make a dictionary of state data
-        all_states = np.unique(out['state'])
-        all_out = dict()
-        for state in all_states:
-            state_inds = out['state'] == state
-            all_out[state] = dict()
-            for key, val in out.items():
-                all_out[state][key] = np.flip(val[state_inds])
-            
-            for item in convert_items:
-                all_out[state][item] = np.array([intfun(s) for s in all_out[state][item]])
+        # Otherwise group all states into one table, oldest rows first
+        for item in convert_items:
+            out[item] = int_column(out[item])
         
-        return all_out
+        return series_table({key: np.flip(val) for key, val in out.items()}, 'state')
 
 
-def get_data_c19(country, filename):
+# Non-numeric Covid Tracking columns
+ctrack_label_headers = ('date', 'day', 'state', 'hash', 'dateChecked')
+
+
+@timed('metrics.ctrack_matrix')
+def get_matrix_ctrack(fname, fields = None, compact = False):
     """
-    Reads (day, value) pairs from CSV file from the COVID-19 Github page
+    Returns the Covid Tracking data as dense state x date arrays on a shared
+    daily calendar. The output dictionary holds "states" (postal codes), 
+    "days" (datetime64[D]) and one float array per field, with NaN where a 
+    state has no row or a blank value for a date. Fields missing from the
+    file (older snapshots lack some) are all NaN. By default all numeric 
+    fields are included. With compact = True the arrays are float32.
     """
     
-    with open(filename, 'rt') as fid:
-        txtgen = [foo(astr) for astr in fid.readlines()]
+    columns = cached_columns(fname, load_ctrack_columns, ctrack_version)
+    if fields is None:
+        fields = [key for key in columns.keys() if key not in ctrack_label_headers]
     
-    all_countries = np.loadtxt(txtgen,
-                               delimiter = ',', skiprows = 1,
-                               usecols = (1), dtype = str)
-        
+    states, state_inds = np.unique(columns['state'], return_inverse = True)
+    days = columns['day']
+    start = days.min() if len(days) > 0 else np.datetime64('today', 'D')
+    n_days = int((days.max() - start).astype(int)) + 1 if len(days) > 0 else 0
+    day_inds = (days - start).astype(int)
     
-    all_data = np.loadtxt(txtgen,
-                               delimiter = ',', skiprows = 1,
-                               dtype = str)[:, 4:].astype(int)
+    out = {'states': states, 'days': start + np.arange(n_days)}
+    for field in fields:
+        matrix = np.full((len(states), n_days), np.nan, 
+                         dtype = np.float32 if compact else float)
+        if field in columns:
+            matrix[state_inds, day_inds] = float_column(columns[field])
+        out[field] = matrix
     
-    dates_out = np.loadtxt(txtgen,
-                               delimiter = ',', max_rows = 1,
-                               dtype = str)[4:]
+    return out
+
+
+# Leading CSSE time series columns; the rest are one column per date
+c19_label_headers = ('Province/State', 'Country/Region', 'Lat', 'Long')
+
+
+@timed('parse.c19')
+def load_c19_columns(fname):
+    """
+    Reads a CSSE time series CSV file (e.g. time_series_covid19_deaths_global)
+    once and indexes it by country. Returns a dictionary holding the per-row
+    province, country and rows x dates "data" matrix, the header "dates",
+    and per-country rollups: the sorted "countries", the sum of all of each
+    country's rows ("country_total") and its national row ("country_national";
+    the row without a province where there is one, else the total).
+    """
     
-    data_out = all_data[np.where(all_countries == country)[0], :]
-    if country == 'Canada':
-        return np.sum(data_out, 0), dates_out        
-        
+    with open(fname, 'rt') as fid:
+        headers, columns = read_columns(fid)
+    
+    n_labels = len(c19_label_headers)
+    province, country = columns[0], columns[1]
+    if len(columns) > n_labels and len(province) > 0:
+        data = int_column(np.column_stack(columns[n_labels:]))
+    else:
+        data = np.zeros((len(province), len(headers) - n_labels), dtype = int)
+    
+    # Sum each country's block of rows in one pass
+    order, countries, offsets = group_rows(country)
+    if len(countries) > 0:
+        total = np.add.reduceat(data[order], offsets[:-1], axis = 0)
     else:
-        keep_ind = np.argmax(data_out[:, -1])  # Full country will have highest count
-        return data_out[keep_ind, :], dates_out
+        total = np.zeros((0, data.shape[1]), dtype = data.dtype)
+    
+    # National rows, where present, replace the totals
+    national = total.copy()
+    blank = np.flatnonzero(province == '')
+    national[np.searchsorted(countries, country[blank])] = data[blank]
+    
+    return {'province': province, 'country': country, 'data': data,
+            'dates': np.array(headers[n_labels:]),
+            'countries': countries, 'country_total': total,
+            'country_national': national}
 
 
-def get_data_ihme(fname):
+@timed('load.c19')
+def get_data_c19(country, filename, rollup = False, compact = False):
     """
-    Load the IHME data projections; returns a dictionary of dictionaries
-    containing the header data for each stored location.
+    Reads (day, value) pairs from CSV file from the COVID-19 Github page
+    
+    Returns the country's national row, or the sum over its provinces when
+    it has none (e.g. Canada). With rollup = True the sum over every row of
+    the country (including overseas territories) is returned instead. With
+    compact = True the counts are int32.
     """
     
-    with open(fname, 'rt') as fid:
-        txtgen = [foo(astr) for astr in fid.readlines()]
+    data = cached_columns(filename, load_c19_columns, c19_version)
+    ind = np.searchsorted(data['countries'], country)
+    if ind == len(data['countries']) or data['countries'][ind] != country:
+        raise KeyError('Country "%s" not found in %s' % (country, filename))
+    
+    key = 'country_total' if rollup else 'country_national'
+    if compact:
+        return compact_column(data[key][ind]), data['dates']
+    return data[key][ind], data['dates']
+
+
+# IHME columns kept as strings; everything else is read as float
+ihme_str_headers = ('location', 'date', 'location_name')
+
+# File read from IHME release archives when no member is given
+ihme_member = 'Hospitalization_all_locs.csv'
+
+
+def filter_ihme_lines(fid, headers, locations):
+    """
+    Yields the lines of an open IHME CSV file (past the header) belonging to
+    the requested locations. IHME files keep each location's rows together,
+    so reading stops at the first other row once every requested location
+    has been seen.
+    """
+    
+    loc_ind = headers.index(ihme_keyname(headers))
+    wanted = set(locations)
+    seen = set()
+    for line in fid:
+        # Cheap substring test before parsing the quoted fields
+        if any(name in line for name in wanted):
+            loc = next(csv.reader([line]))[loc_ind]
+            if loc in wanted:
+                seen.add(loc)
+                yield line
+                continue
         
-    # Get the headers
-    headers = np.loadtxt(txtgen, delimiter = ',', max_rows = 1, dtype = str, 
-                         unpack = True)
-    headers = [s.replace('"', '') for s in headers]
-    data = dict()
+        if seen == wanted:
+            break
+
+
+@timed('parse.ihme')
+def read_ihme_columns(fid, locations = None, columns = None):
+    """
+    Reads an open IHME CSV file with quote-aware tokenizing, streaming the
+    rows through a single np.loadtxt pass into a structured array: strings
+    are read as objects and then stored at their real width. Returns a
+    dictionary of arrays keyed by header, with string location and date
+    columns and float columns for everything else.
     
+    If a list of locations is given only their rows are kept, and the file
+    is read only as far as the last of their blocks. If a list of columns
+    is given only those (and the location and date) are parsed.
+    """
     
+    headers = next(csv.reader([fid.readline()]))
+    keep = [ind for ind, header in enumerate(headers) 
+            if columns is None or header in columns or 
+            header in (ihme_keyname(headers), 'date')]
+    dtype = [(headers[ind], object if headers[ind] in ihme_str_headers else float)
+             for ind in keep]
     
-    for ind, header in enumerate(headers):
-        print(header)
-        if (header == 'location') or header == ('date') or header == ('location_name'):
-            
-            data[header] = np.loadtxt(txtgen, dtype = str, delimiter = ',', 
-               skiprows = 1, usecols = (ind, ), unpack = True)
-            data[header] = np.array([s.replace('"', '') for s in data[header]])
+    if locations is not None:
+        lines = filter_ihme_lines(fid, headers, locations)
+    else:
+        lines = iter(fid)
+    
+    first = next(lines, None)
+    if first is None:
+        table = np.zeros(0, dtype = dtype)
+    else:
+        table = np.loadtxt(itertools.chain([first], lines), dtype = dtype, 
+                           delimiter = ',', quotechar = '"', ndmin = 1, 
+                           usecols = keep)
+    
+    data = dict()
+    for header in table.dtype.names:
+        if header in ihme_str_headers:
+            data[header] = table[header].astype(str)
         else:
-            data[header] = np.loadtxt(txtgen, dtype = float, delimiter = ',', 
-                                     skiprows = 1, usecols = (ind,),  unpack = True)
+            data[header] = np.ascontiguousarray(table[header])
+    del table
+    
+    if 'date' in data:
+        data['day'] = to_days(data['date'])
+    
+    return data
+
+
+def ihme_keyname(data):
+    """
+    Returns the header holding location names (given the data dictionary or
+    header list); older releases use "location" and newer ones 
+    "location_name".
+    """
+    
+    if 'location' in data:
+        return 'location'
+    else:
+        return 'location_name'
+
+
+def find_ihme_member(archive):
+    """
+    Returns the name of the hospitalization CSV inside an IHME release 
+    archive.
+    """
+    
+    names = [name for name in archive.namelist() 
+             if name.split('/')[-1] == ihme_member]
+    if len(names) != 1:
+        raise ValueError('Expected one %s in %s; found %i' % 
+                         (ihme_member, archive.filename, len(names)))
+    
+    return names[0]
+
+
+@contextlib.contextmanager
+def open_ihme(fname, member = None):
+    """
+    Opens an IHME CSV file for reading as text. fname may also be a release
+    zip archive, in which case the member is streamed without extracting it.
+    """
+    
+    if zipfile.is_zipfile(fname):
+        with zipfile.ZipFile(fname) as archive:
+            if member is None:
+                member = find_ihme_member(archive)
+            with io.TextIOWrapper(archive.open(member), encoding = 'utf-8') as fid:
+                yield fid
+    else:
+        with open(fname, 'rt') as fid:
+            yield fid
+
+
+@timed('parse.ihme_grouped')
+def load_ihme_columns(fname, member = None):
+    """
+    Reads an IHME CSV file (or release zip archive) and orders its rows by 
+    location, so that each location's rows form one contiguous block.
+    """
+    
+    with open_ihme(fname, member) as fid:
+        data = read_ihme_columns(fid)
+    
+    order = group_rows(data[ihme_keyname(data)])[0]
+    return {key: val[order] for key, val in data.items()}
+
+
+def ihme_table(data, columns = None, compact = False):
+    """
+    Returns a series_table of IHME columns by location, projected to the
+    requested columns and optionally converted to float32.
+    """
+    
+    keyname = ihme_keyname(data)
+    data = project_columns(data, columns, (keyname, 'date', 'day'))
+    if compact:
+        data = compact_columns(data, ihme_str_headers + ('day', ))
+    
+    return series_table(data, keyname)
+
+
+@timed('load.ihme')
+def get_data_ihme(fname, member = None, location = None, columns = None, 
+                  compact = False):
+    """
+    Load the IHME data projections; returns a series_table which, like a 
+    dictionary of dictionaries, holds the header data for each stored 
+    location.
+    
+    fname may be a CSV file or an IHME release zip archive. For archives,
+    member names the CSV to read; by default the archive's 
+    Hospitalization_all_locs.csv is used.
+    
+    If "location" is given (one name or a list of names) only those 
+    locations are returned. If "columns" is given (a list of headers) only 
+    those columns, plus the location, "date" and "day", are returned. 
+    Unless the file is already cached, it is then streamed and only the 
+    requested rows and columns are parsed.
+    
+    With compact = True the projections are stored as float32.
+    """
+    
+    if location is None and columns is None:
+        data = cached_columns(fname, load_ihme_columns, ihme_version, member)
         
-            
-    # Set up dictionary of all data by state/country
-    try:
-        loc_keys = np.unique(data['location'])
-        keyname = 'location'
-    except KeyError:
-        loc_keys = np.unique(data['location_name'])
-        keyname = 'location_name'
+        # Set up table of all data by state/country
+        return ihme_table(data, compact = compact)
     
-    out = dict()
-    for loc_key in loc_keys:
-        out[loc_key] = dict()
-        for data_key, val in data.items():
-            state_inds = data[keyname] == loc_key
-            out[loc_key][data_key] = val[state_inds]
+    locations = None
+    if location is not None:
+        locations = [location] if isinstance(location, str) else list(location)
+    data = cached_entry(fname, ihme_version, member)
+    if data is None:
+        with open_ihme(fname, member) as fid:
+            data = read_ihme_columns(fid, locations, columns)
+        return ihme_table(data, columns, compact)
     
-    return out
+    data = project_columns(data, columns, (ihme_keyname(data), 'date', 'day'))
+    if locations is None:
+        return ihme_table(data, columns, compact)
+    
+    # Cached rows are ordered by location, so each block is found by bisection
+    keys = data[ihme_keyname(data)]
+    locations = np.unique(locations)
+    starts = np.searchsorted(keys, locations, side = 'left')
+    stops = np.searchsorted(keys, locations, side = 'right')
+    rows = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)] +
+                          [np.array([], dtype = int)])
+    
+    return ihme_table({key: val[rows] for key, val in data.items()}, 
+                      columns, compact)
+
+@timed('dates.to_days')
+def to_days(column):
+    """
+    Converts an array of date strings to datetime64[D] without a Python loop
+    over the rows. Handles the "yyyymmdd" (Covid Tracking), "yyyy-mm-dd" 
+    and "m/d/yyyy" (IHME) and "m/d/yy" (COVID-19 Github) formats; the format
+    is taken from the first entry.
+    """
+    
+    column = np.asarray(column).astype(str)
+    if len(column) == 0:
+        return np.array([], dtype = 'datetime64[D]')
+    
+    first = column.flat[0]
+    if '-' in first:
+        return column.astype('datetime64[D]')
+    
+    if '/' in first:
+        month, sep, rest = np.moveaxis(np.char.partition(column, '/'), -1, 0)
+        day, sep, year = np.moveaxis(np.char.partition(rest, '/'), -1, 0)
+        year, month, day = year.astype(int), month.astype(int), day.astype(int)
+        year = np.where(year < 100, year + 2000, year)
+    else:
+        stamp = column.astype(int)
+        year, month, day = stamp // 10000, stamp // 100 % 100, stamp % 100
+    
+    months = ((year - 1970)*12 + month - 1).astype('datetime64[M]')
+    return months.astype('datetime64[D]') + (day - 1)
+
+
+@timed('dates.format_days')
+def format_days(days):
+    """
+    Formats datetime64[D] values as "yyyymmdd" strings.
+    """
+    
+    return np.char.replace(np.datetime_as_string(days, unit = 'D'), '-', '')
+
+
+def as_day(date_in):
+    """
+    Converts one date (a datetime64 or any string format handled by 
+    to_days) to datetime64[D].
+    """
+    
+    if isinstance(date_in, np.datetime64):
+        return date_in.astype('datetime64[D]')
+    
+    return to_days([date_in])[0]
+
+
+def date_slice(days, start_date = None, stop_date = None):
+    """
+    Returns the slice of a sorted datetime64[D] array from start_date 
+    (inclusive) to stop_date (exclusive), found by binary search. Dates that
+    are not present simply clip to the nearest available day.
+    """
+    
+    start = 0 if start_date is None else np.searchsorted(days, as_day(start_date))
+    stop = len(days) if stop_date is None else np.searchsorted(days, as_day(stop_date))
+    return slice(int(start), int(max(start, stop)))
+
 
 def format_date_ihme(date_in):
     """
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+
+Manifest of rendered figures for skip-if-unchanged rebuilds.
+
+Each figure is identified by a key (layout, location and output directory)
+and a fingerprint of everything that determines its pixels: the series and
+projections actually plotted, the date window they were cut to, the titles
+and plotting options. The manifest records the fingerprint and image file
+of every figure written. On the next run a figure whose fingerprint matches
+and whose image still exists is skipped, so a new tracker snapshot only
+re-renders the figures whose data changed.
+
+    manifest = render_manifest('../images/render_manifest.json')
+    fp = fingerprint('testing', state_long, series, proj, ylpct)
+    if not manifest.is_current(key, fp):
+        ...render and save imname...
+        manifest.record(key, fp, imname)
+    manifest.save()
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from datetime import datetime
+
+# Bump when the figure code changes so every figure is re-rendered
+render_version = 1
+
+
+def update_hash(sha, value):
+    """
+    Feeds a value (arrays, strings, numbers, None, or nested lists, tuples
+    and dictionaries of these) into a hashlib object.
+    """
+
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        sha.update(('array:%s:%s;' % (value.dtype.str, value.shape)).encode('utf-8'))
+        sha.update(value.tobytes())
+    elif isinstance(value, dict):
+        sha.update(b'dict;')
+        for key in sorted(value, key = str):
+            update_hash(sha, str(key))
+            update_hash(sha, value[key])
+    elif isinstance(value, (list, tuple)):
+        sha.update(('seq:%i;' % len(value)).encode('utf-8'))
+        for item in value:
+            update_hash(sha, item)
+    else:
+        sha.update(('%s:%r;' % (type(value).__name__, value)).encode('utf-8'))
+
+
+def fingerprint(*parts):
+    """
+    Returns a hex digest identifying the values passed.
+    """
+
+    sha = hashlib.sha1()
+    update_hash(sha, render_version)
+    for part in parts:
+        update_hash(sha, part)
+
+    return sha.hexdigest()
+
+
+class render_manifest:
+    """
+    JSON record of the fingerprint and image file of each rendered figure.
+    """
+
+    def __init__(self, path):
+        """
+        Open the manifest stored at path; a missing file starts empty.
+        """
+
+        self.path = path
+        try:
+            with open(path, 'rt') as fid:
+                self.figures = json.load(fid)['figures']
+        except (OSError, ValueError, KeyError):
+            self.figures = dict()
+
+    def is_current(self, key, fp):
+        """
+        Returns True if figure "key" was rendered with fingerprint fp and its
+        image still exists.
+        """
+
+        entry = self.figures.get(key)
+        return (entry is not None and entry['fingerprint'] == fp and
+                os.path.isfile(entry['image']))
+
+    def image(self, key):
+        """
+        Returns the image file last recorded for a figure, or None.
+        """
+
+        entry = self.figures.get(key)
+        return None if entry is None else entry['image']
+
+    def record(self, key, fp, image):
+        """
+        Records that figure "key" was rendered with fingerprint fp to image.
+        """
+
+        self.figures[key] = {'fingerprint': fp, 'image': image,
+                             'rendered': datetime.now().isoformat(timespec = 'seconds')}
+
+    def save(self):
+        """
+        Writes the manifest (through a temporary file).
+        """
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        tmp_name = self.path + '.tmp'
+        with open(tmp_name, 'wt') as fid:
+            json.dump({'figures': self.figures}, fid, indent = 1, sort_keys = True)
+        os.replace(tmp_name, self.path)
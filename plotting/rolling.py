@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+
+Rolling-window statistics for daily series.
+
+rolling_sum, rolling_mean and rolling_median work along one axis of an
+array, so every location (and release) of a matrix is smoothed in one call.
+Windows are either trailing (the window ends on each day) or centered. Near
+the ends of a series the window simply holds fewer days instead of being
+padded with zeros, so the value for the latest day reflects the latest data.
+NaN and infinite values are treated as missing and skipped.
+
+Sums and means cost O(n) whatever the window length. Counts of valid
+values come from differences of their (exact, integer) cumulative sum. Sums
+come from cumulative sums of the finite values restarted every "window"
+days: each window is the tail of one block plus the head of the next, so no
+value is ever subtracted back out and a large value cannot wipe out the
+small ones that follow it. Medians keep a sorted copy of each window and
+swap the oldest day for the newest. For short windows the swap is done for
+all series at once with vectorized O(window) shifts; longer windows keep a
+bisect-sorted list per series. rolling_ratio divides two rolling sums, giving
+NaN where the denominator sums to 0. rolling_window keeps a trailing window
+up to date as new days arrive, in O(1) per day for sums and means and
+O(log window) for medians:
+
+    window = rolling_window(7, n_series = len(states))
+    for day in new_days:
+        window.append(day)
+    latest = window.mean()
+
+"""
+
+import bisect
+import numpy as np
+
+# Longest window whose medians are updated for all series at once
+short_window = 32
+
+
+def window_bounds(window, center = False):
+    """
+    Returns the number of days before and after each day covered by a
+    window. Even centered windows extend one extra day into the past.
+    """
+
+    after = window // 2 if center else 0
+    return window - 1 - after, after
+
+
+def padded_windows(values, window, center, axis):
+    """
+    Returns values with axis moved last, non-finite values replaced by NaN
+    and NaN padded at both ends so that position i of a trailing window
+    over the result covers day i.
+    """
+
+    values = np.moveaxis(np.asarray(values, dtype = float), axis, -1)
+    values = np.where(np.isfinite(values), values, np.nan)
+    before, after = window_bounds(window, center)
+    pad = [(0, 0)]*(values.ndim - 1) + [(before, after)]
+    return np.pad(values, pad, constant_values = np.nan)
+
+
+def window_sums(values, window):
+    """
+    Returns the sum of every run of "window" values along the last axis
+    (length n - window + 1), from cumulative sums restarted every window
+    values.
+    """
+
+    n_days = values.shape[-1]
+    n_blocks = -(-n_days // window)
+    pad = [(0, 0)]*(values.ndim - 1) + [(0, n_blocks*window - n_days)]
+    blocks = np.pad(values, pad).reshape(values.shape[:-1] + (n_blocks, window))
+
+    # Sum from each day to the end of its block, and from the block start
+    tails = np.cumsum(blocks[..., ::-1], axis = -1)[..., ::-1]
+    heads = np.cumsum(blocks, axis = -1)
+    tails = tails.reshape(values.shape[:-1] + (-1, ))[..., :n_days - window + 1]
+    heads = heads.reshape(values.shape[:-1] + (-1, ))[..., window - 1:n_days]
+
+    # A window starting on a block boundary is that block's tail alone
+    starts = np.arange(n_days - window + 1) % window
+    return tails + np.where(starts == 0, 0, heads)
+
+
+def window_counts(valid, window):
+    """
+    Returns the number of True values in every run of "window" values along
+    the last axis, from differences of their (exact, integer) cumulative sum.
+    """
+
+    counts = np.cumsum(valid, axis = -1)
+    counts[..., window:] -= counts[..., :-window].copy()
+    return counts[..., window - 1:]
+
+
+def rolling_count_sum(values, window, center = False, axis = -1):
+    """
+    Returns the number of valid values and their sum in each window, with
+    axis moved last.
+    """
+
+    padded = padded_windows(values, window, center, axis)
+    valid = ~np.isnan(padded)
+    return window_counts(valid, window), window_sums(np.where(valid, padded, 0.), window)
+
+
+def rolling_sum(values, window, center = False, axis = -1, min_periods = 1):
+    """
+    Rolling sum along an axis. Windows with fewer than min_periods valid
+    values are NaN.
+    """
+
+    counts, sums = rolling_count_sum(values, window, center, axis)
+    sums[counts < min_periods] = np.nan
+    return np.moveaxis(sums, -1, axis)
+
+
+def rolling_mean(values, window, center = False, axis = -1, min_periods = 1):
+    """
+    Rolling mean along an axis. Windows with fewer than min_periods valid
+    values are NaN.
+    """
+
+    counts, sums = rolling_count_sum(values, window, center, axis)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        means = sums/counts
+    means[counts < min_periods] = np.nan
+    return np.moveaxis(means, -1, axis)
+
+
+def rolling_ratio(numerator, denominator, window, center = False, axis = -1,
+                  min_periods = 1):
+    """
+    Ratio of the rolling sums of two series (e.g. positive over total tests),
+    NaN where the denominator sums to 0 or has too few valid values.
+    """
+
+    num = rolling_sum(numerator, window, center, axis, min_periods)
+    den = rolling_sum(denominator, window, center, axis, min_periods)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(den != 0, num/den, np.nan)
+
+
+def short_window_medians(padded, window):
+    """
+    Medians of every trailing window over a series x day array, NaN padded
+    in front, for all series at once. Each row of "ordered" holds the
+    current window sorted with NaN last; every day the oldest value is
+    swapped for the newest by shifting the values in between.
+    """
+
+    n_series, n_days = padded.shape
+    ordered = np.full((n_series, window), np.nan)
+    slots = np.arange(window)
+    rows = np.arange(n_series)
+    medians = np.full((n_series, n_days - window + 1), np.nan)
+    for day in range(n_days):
+        new = padded[:, day]
+        if day >= window:
+            old = padded[:, day - window]
+            out_pos = np.where(np.isnan(old), window - 1,
+                               (ordered < old[:, np.newaxis]).sum(axis = 1))
+        else:
+            out_pos = np.full(n_series, window - 1)  # Still NaN padding
+        in_pos = (ordered < new[:, np.newaxis]).sum(axis = 1)
+        in_pos = np.where(np.isnan(new), window - 1, in_pos - (in_pos > out_pos))
+
+        kept = slots - (slots > in_pos[:, np.newaxis])
+        source = np.minimum(kept + (kept >= out_pos[:, np.newaxis]), window - 1)
+        ordered = np.take_along_axis(ordered, source, axis = 1)
+        ordered[rows, in_pos] = new
+
+        if day >= window - 1:
+            count = np.sum(~np.isnan(ordered), axis = 1)
+            lower = ordered[rows, np.maximum(count - 1, 0)//2]
+            upper = ordered[rows, count//2]
+            medians[:, day - window + 1] = 0.5*(lower + upper)
+
+    return medians
+
+
+def sorted_medians(series, window):
+    """
+    Medians of every trailing window over one NaN padded series (a list),
+    keeping the valid values of the current window in a sorted list.
+    """
+
+    medians = [np.nan]*(len(series) - window + 1)
+    ordered = list()
+    for day, val in enumerate(series):
+        if val == val:
+            bisect.insort(ordered, val)
+        if day >= window:
+            old = series[day - window]
+            if old == old:
+                del ordered[bisect.bisect_left(ordered, old)]
+        if day >= window - 1 and ordered:
+            count = len(ordered)
+            medians[day - window + 1] = 0.5*(ordered[(count - 1)//2] + ordered[count//2])
+
+    return medians
+
+
+def rolling_median(values, window, center = False, axis = -1, min_periods = 1):
+    """
+    Rolling median along an axis. Windows with fewer than min_periods valid
+    values are NaN.
+    """
+
+    padded = padded_windows(values, window, center, axis)
+    shape = padded.shape[:-1]
+    padded = padded.reshape((-1, padded.shape[-1]))
+    if window <= short_window:
+        medians = short_window_medians(padded, window)
+    else:
+        medians = np.array([sorted_medians(row, window) for row in padded.tolist()])
+    medians = medians.reshape(shape + (-1, ))
+
+    counts = window_counts(~np.isnan(padded), window).reshape(medians.shape)
+    medians[counts < min_periods] = np.nan
+    return np.moveaxis(medians, -1, axis)
+
+
+class rolling_window:
+    """
+    Trailing window over one or more series that is updated one day at a
+    time. Sums are kept with a compensated (Neumaier) running total, so each
+    update is O(1) per series and large values leaving the window do not
+    take the small ones with them; medians keep a bisect-sorted list per
+    series.
+    """
+
+    def __init__(self, window, n_series = None, history = None):
+        """
+        Create an empty window of "window" days over n_series series (a
+        single series if None). history optionally holds past days along
+        the last axis to start from.
+        """
+
+        shape = () if n_series is None else (n_series, )
+        self.window = window
+        self.values = np.full(shape + (window, ), np.nan)
+        self.total = np.zeros(shape)
+        self.error = np.zeros(shape)
+        self.count = np.zeros(shape, dtype = int)
+        self.ordered = [list() for ind in range(int(np.prod(shape)))]
+        self.pos = 0
+
+        if history is not None:
+            history = np.asarray(history, dtype = float)
+            for ind in range(max(0, history.shape[-1] - window), history.shape[-1]):
+                self.append(history[..., ind])
+
+    def add(self, values):
+        """
+        Adds values to the running total, keeping the lost low-order part.
+        """
+
+        total = self.total + values
+        self.error += np.where(np.abs(self.total) >= np.abs(values),
+                               (self.total - total) + values,
+                               (values - total) + self.total)
+        self.total = total
+
+    def append(self, values):
+        """
+        Adds the next day's value of each series, dropping the oldest day.
+        """
+
+        values = np.asarray(values, dtype = float)
+        values = np.where(np.isfinite(values), values, np.nan)
+        old = self.values[..., self.pos].copy()
+        self.values[..., self.pos] = values
+        self.pos = (self.pos + 1) % self.window
+
+        old_valid, new_valid = ~np.isnan(old), ~np.isnan(values)
+        self.add(-np.where(old_valid, old, 0.))
+        self.add(np.where(new_valid, values, 0.))
+        self.count = self.count - old_valid + new_valid
+
+        for ordered, out, val in zip(self.ordered, np.ravel(old), np.ravel(values)):
+            if out == out:
+                del ordered[bisect.bisect_left(ordered, out)]
+            if val == val:
+                bisect.insort(ordered, val)
+
+    def sum(self, min_periods = 1):
+        """
+        Returns the sum over the current window.
+        """
+
+        return np.where(self.count >= min_periods, self.total + self.error, np.nan)
+
+    def mean(self, min_periods = 1):
+        """
+        Returns the mean over the current window.
+        """
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.where(self.count >= min_periods,
+                            (self.total + self.error)/self.count, np.nan)
+
+    def median(self, min_periods = 1):
+        """
+        Returns the median over the current window.
+        """
+
+        medians = [0.5*(ordered[(len(ordered) - 1)//2] + ordered[len(ordered)//2])
+                   if ordered else np.nan for ordered in self.ordered]
+        medians = np.reshape(medians, self.count.shape)
+        return np.where(self.count >= min_periods, medians, np.nan)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+
+Compact container for per-location time series.
+
+A series_table holds the rows of every location of one source file:
+
+    - one contiguous 2-D block (rows x columns) per numeric dtype, so
+      compact float32 and integer columns keep their own dtypes,
+    - string columns (location names, dates, hashes, ...) as small integer
+      codes into one array of distinct values each,
+    - any other columns (e.g. datetime64 days) as plain arrays,
+    - for numeric columns passed as masked arrays (see read_data's compact
+      mode), a boolean mask of the missing entries,
+
+with each location's rows stored together. All arrays are read-only, since
+tables are shared between callers (see loader_registry.py). Indexing the
+table by location returns a series_view, which is indexed by column name
+like the per-location dictionaries it replaces:
+
+    all_ihme = get_data_ihme(model_fname)
+    all_ihme['New York']['deaths_mean']    # view into the numeric block
+    all_ihme['New York']['date']           # decoded string array
+
+"""
+
+import numpy as np
+
+from instrument import timed
+
+
+def code_dtype(n_values):
+    """
+    Returns the smallest unsigned integer dtype able to index n_values.
+    """
+
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_values <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class series_table:
+    """
+    Rows of many locations stored in numeric blocks plus categorical
+    string columns, indexed by location.
+    """
+
+    __slots__ = ('keyname', 'blocks', 'columns', 'masks', 'categories', 'codes',
+                 'extra', 'locations', 'bounds')
+
+    @timed('group.series_table')
+    def __init__(self, data, keyname):
+        """
+        Build a table from a dictionary of equal-length columns, grouping
+        rows by the values of column "keyname". Rows keep their order within
+        each location. Numeric columns of the same dtype share one block;
+        masked entries of masked array columns are kept as masks.
+        """
+
+        keys = np.asarray(data[keyname])
+        locations, inverse = np.unique(keys, return_inverse = True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind = 'stable')
+        if np.array_equal(order, np.arange(len(order))):
+            order = slice(None)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(inverse,
+                                                             minlength = len(locations)))))
+
+        self.keyname = keyname
+        self.locations = locations.tolist()
+        self.bounds = {loc: (int(offsets[ind]), int(offsets[ind + 1]))
+                       for ind, loc in enumerate(self.locations)}
+
+        # Column name -> (block dtype, position in that block)
+        by_dtype = dict()
+        for key, val in data.items():
+            if val.dtype.kind in 'biuf':
+                by_dtype.setdefault(val.dtype.str, list()).append(key)
+        self.columns = {key: (dtype, ind) for dtype, names in by_dtype.items()
+                        for ind, key in enumerate(names)}
+        self.blocks = dict()
+        self.masks = dict()
+        for dtype, names in by_dtype.items():
+            block = np.empty((len(keys), len(names)), dtype = dtype, order = 'F')
+            for ind, key in enumerate(names):
+                block[:, ind] = np.ma.getdata(data[key])[order]
+                if np.ma.is_masked(data[key]):
+                    self.masks[key] = np.ma.getmaskarray(data[key])[order]
+            self.blocks[dtype] = block
+
+        self.categories = dict()
+        self.codes = dict()
+        self.extra = dict()
+        for key, val in data.items():
+            if key in self.columns:
+                continue
+            if val.dtype.kind in 'US':
+                values, codes = np.unique(val, return_inverse = True)
+                self.categories[key] = values
+                self.codes[key] = codes.ravel()[order].astype(code_dtype(len(values)))
+            else:
+                self.extra[key] = np.ascontiguousarray(val[order])
+
+        for arrays in (self.blocks, self.masks, self.categories, self.codes, self.extra):
+            for val in arrays.values():
+                val.flags.writeable = False
+
+    def column(self, key, start = 0, stop = None):
+        """
+        Returns rows start:stop of a column; numeric columns are read-only
+        views into their block (masked arrays if entries are missing) and
+        string columns are decoded.
+        """
+
+        if key in self.columns:
+            dtype, ind = self.columns[key]
+            values = self.blocks[dtype][start:stop, ind]
+            if key in self.masks:
+                return np.ma.masked_array(values, mask = self.masks[key][start:stop])
+            return values
+        if key in self.codes:
+            return self.categories[key][self.codes[key][start:stop]]
+
+        return self.extra[key][start:stop]
+
+    def keys(self):
+        """
+        Returns the location names.
+        """
+
+        return list(self.locations)
+
+    def column_names(self):
+        """
+        Returns the names of every column.
+        """
+
+        return list(self.columns) + list(self.codes) + list(self.extra)
+
+    def nbytes(self):
+        """
+        Returns the number of bytes held by the table's arrays.
+        """
+
+        return (sum(val.nbytes for val in self.blocks.values()) +
+                sum(val.nbytes for val in self.masks.values()) +
+                sum(val.nbytes for val in self.categories.values()) +
+                sum(val.nbytes for val in self.codes.values()) +
+                sum(val.nbytes for val in self.extra.values()))
+
+    def __getitem__(self, location):
+        start, stop = self.bounds[location]
+        return series_view(self, start, stop)
+
+    def __contains__(self, location):
+        return location in self.bounds
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def get(self, location, default = None):
+        return self[location] if location in self.bounds else default
+
+    def items(self):
+        return [(loc, self[loc]) for loc in self.locations]
+
+    def values(self):
+        return [self[loc] for loc in self.locations]
+
+
+class series_view:
+    """
+    The rows of one location of a series_table, indexed by column name.
+    """
+
+    __slots__ = ('table', 'start', 'stop')
+
+    def __init__(self, table, start, stop):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def __getitem__(self, key):
+        return self.table.column(key, self.start, self.stop)
+
+    def __contains__(self, key):
+        table = self.table
+        return key in table.columns or key in table.codes or key in table.extra
+
+    def __iter__(self):
+        return iter(self.table.column_names())
+
+    def __len__(self):
+        return len(self.table.column_names())
+
+    def keys(self):
+        return self.table.column_names()
+
+    def get(self, key, default = None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
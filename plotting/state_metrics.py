@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+
+Derived Covid Tracking metrics for all states at once.
+
+The functions here work on the state x date arrays returned by
+read_data.get_matrix_ctrack, so daily increments, positive test ratios and
+smoothing run as single NumPy calls over every state instead of one state at
+a time as in plot_state_data.py.
+
+"""
+
+import numpy as np
+
+from read_data import get_matrix_ctrack
+from rolling import rolling_mean, rolling_ratio
+from instrument import timed
+
+
+def daily_change(values):
+    """
+    Returns the day-over-day change along the last axis. As with
+    np.diff(..., prepend = 0) on one state's series, the first reported value
+    counts in full; days before it stay NaN.
+    """
+
+    values = np.asarray(values, dtype = float)
+    started = np.cumsum(~np.isnan(values), axis = -1) > 0
+    prev = np.zeros_like(values)
+    prev[..., 1:] = np.where(started[..., :-1], values[..., :-1], 0.)
+    return values - prev
+
+
+@timed('metrics.derived')
+def derived_metrics(matrix, window = 7):
+    """
+    Returns the daily increments, percentage positive and trailing
+    "window" day averages for every state from a get_matrix_ctrack
+    dictionary. Each output is a state x date array on the same calendar.
+    """
+
+    out = dict()
+    out['dpos'] = daily_change(matrix['positive'])
+    out['dneg'] = daily_change(matrix['negative'])
+    out['dhosp'] = daily_change(matrix['hospitalizedCurrently'])
+    out['ddhosp'] = daily_change(out['dhosp'])
+    out['ddeath'] = daily_change(matrix['death'])
+    out['dtotal'] = out['dpos'] + out['dneg']
+    out['pct_pos'] = 100*rolling_ratio(out['dpos'], out['dtotal'], 1)
+
+    out['dtotal_avg'] = rolling_mean(out['dtotal'], window)
+    out['dpos_avg'] = rolling_mean(out['dpos'], window)
+    out['pct_pos_avg'] = 100*rolling_ratio(out['dpos'], out['dtotal'], window)
+
+    return out
+
+
+def get_state_metrics(fname, window = 7):
+    """
+    Loads a Covid Tracking snapshot as state x date arrays and adds the
+    derived metrics. Returns a single dictionary holding both.
+    """
+
+    matrix = get_matrix_ctrack(fname, ['positive', 'negative', 'death',
+                                       'hospitalizedCurrently'])
+    matrix.update(derived_metrics(matrix, window))
+    return matrix